@@ -272,6 +272,7 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_FILTER_BACKENDS': (
         'rest_framework_datatables.filters.DatatablesFilterBackend',
+        'gp_projects.filters.SpatialTemporalFilter',
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework_datatables.pagination.DatatablesPageNumberPagination',
     'PAGE_SIZE': 50,
@@ -280,6 +281,62 @@ REST_FRAMEWORK = {
 # turn branding off
 GEO_BRANDING = False
 
+# geojson map feeds: rows fetched per database round trip, and characters sent per block of the response
+GEOJSON_FEED_CHUNK_SIZE = env.int('GEOJSON_FEED_CHUNK_SIZE', default=200)
+GEOJSON_FEED_BLOCK_SIZE = env.int('GEOJSON_FEED_BLOCK_SIZE', default=64 * 1024)
+
+# the default distance, in metres, for the near= filter of the gp_projects list APIs
+FILTER_NEAR_DISTANCE = env.float('FILTER_NEAR_DISTANCE', default=1000.0)
+
+# decimal places of the coordinates in the compact geojson and geobuf formats (6 places is about 10cm)
+GEOJSON_PRECISION = env.int('GEOJSON_PRECISION', default=6)
+
+# point clustering: the grid cell size in pixels
+CLUSTER_CELL_PIXELS = env.int('CLUSTER_CELL_PIXELS', default=40)
+
+# usermap feeds are cached until the map changes, for at most USERMAP_CACHE_TIMEOUT seconds;
+# documents larger than USERMAP_CACHE_MAX_SIZE characters are not cached
+USERMAP_CACHE_TIMEOUT = env.int('USERMAP_CACHE_TIMEOUT', default=24 * 60 * 60)
+USERMAP_CACHE_MAX_SIZE = env.int('USERMAP_CACHE_MAX_SIZE', default=8 * 1024 * 1024)
+
+# track simplification: tracks requested with zoom= are kept accurate to this many pixels, and each track
+# stores an overview copy simplified for this zoom level and below
+TRACK_SIMPLIFY_PIXELS = env.float('TRACK_SIMPLIFY_PIXELS', default=1.0)
+TRACK_OVERVIEW_ZOOM = env.int('TRACK_OVERVIEW_ZOOM', default=10)
+
+# the myprofiles manifests are cached until a profile they include changes, for at most this many seconds
+MANIFEST_CACHE_TIMEOUT = env.int('MANIFEST_CACHE_TIMEOUT', default=24 * 60 * 60)
+
+# the profiles Catalog page statistics are cached for this many seconds, or until the profiles change;
+# tables estimated to hold more than CATALOG_STATS_EXACT_LIMIT rows are not counted exactly
+CATALOG_STATS_TIMEOUT = env.int('CATALOG_STATS_TIMEOUT', default=300)
+CATALOG_STATS_EXACT_LIMIT = env.int('CATALOG_STATS_EXACT_LIMIT', default=100000)
+
+# userproject ingest
+# uploaded userprojects are streamed from storage to local disk in blocks of this many bytes,
+# this is the most memory a single ingest will hold for the copy regardless of the project size
+USERPROJECT_COPY_CHUNK_SIZE = env.int('USERPROJECT_COPY_CHUNK_SIZE', default=1024 * 1024)
+# export ingest timings as prometheus metrics (needs the prometheus_client package)
+USERPROJECT_INGEST_METRICS = env.bool('USERPROJECT_INGEST_METRICS', default=False)
+# largest chunk accepted by the resumable userproject upload endpoint
+USERPROJECT_UPLOAD_MAX_CHUNK_SIZE = env.int('USERPROJECT_UPLOAD_MAX_CHUNK_SIZE', default=16 * 1024 * 1024)
+# scratch space for the files used during an ingest: files are put on tmpfs while they fit within the budget
+# (in bytes), larger ones go to USERPROJECT_SCRATCH_DIR, which defaults to the system temp directory
+USERPROJECT_SCRATCH_TMPFS = env('USERPROJECT_SCRATCH_TMPFS', default='/dev/shm')
+USERPROJECT_SCRATCH_TMPFS_BUDGET = env.int('USERPROJECT_SCRATCH_TMPFS_BUDGET', default=256 * 1024 * 1024)
+USERPROJECT_SCRATCH_DIR = env('USERPROJECT_SCRATCH_DIR', default=None)
+# number of tracks inserted per batch, each track holds all of its vertices in memory until it is written
+USERPROJECT_TRACK_BATCH_SIZE = env.int('USERPROJECT_TRACK_BATCH_SIZE', default=50)
+# number of notes, or images, inserted per batch
+USERPROJECT_NOTE_BATCH_SIZE = env.int('USERPROJECT_NOTE_BATCH_SIZE', default=500)
+# number of images decoded, resized and uploaded in parallel by each ingest, 1 processes them one at a time
+USERPROJECT_IMAGE_WORKERS = env.int('USERPROJECT_IMAGE_WORKERS', default=4)
+# the web suitable image made for each ImageNote, size of the bounding box in pixels and JPEG quality
+USERPROJECT_WEBIMG_SIZE = env.int('USERPROJECT_WEBIMG_SIZE', default=480)
+USERPROJECT_WEBIMG_QUALITY = env.int('USERPROJECT_WEBIMG_QUALITY', default=85)
+# make ImageNote thumbnails of this size on the server, leave unset to keep the thumbnail made by geopaparazzi
+USERPROJECT_THUMBNAIL_SIZE = env.int('USERPROJECT_THUMBNAIL_SIZE', default=None)
+
 # schedule data cleanup
 CELERY_BEAT_SCHEDULE = {
  'clean-up-user-projects-every-day': {
@@ -80,6 +80,9 @@ AWS_S3_OBJECT_PARAMETERS = {
 }
 AWS_DEFAULT_ACL = env('DJANGO_AWS_DEFAULT_ACL')
 AWS_S3_ENDPOINT_URL = f'https://%s' % env('DJANGO_AWS_S3_ENDPOINT_URL')
+# https://django-storages.readthedocs.io/en/latest/backends/amazon-S3.html#settings
+# spool downloaded objects to disk past this size, otherwise large userprojects are buffered in memory
+AWS_S3_MAX_MEMORY_SIZE = USERPROJECT_COPY_CHUNK_SIZE  # noqa F405
 
 # STATIC
 # ------------------------
@@ -185,6 +188,12 @@ LOGGING = {
             'level': 'ERROR',
             'handlers': ['console', 'mail_admins'],
             'propagate': True
+        },
+        # userproject ingest progress and timings
+        'profiles': {
+            'level': 'INFO',
+            'handlers': ['console'],
+            'propagate': False
         }
     }
 }
@@ -0,0 +1,60 @@
+"""
+Test helpers shared by the apps
+"""
+from contextlib import contextmanager
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test.utils import CaptureQueriesContext
+
+
+@contextmanager
+def capture_on_commit_callbacks(using=DEFAULT_DB_ALIAS, execute=False):
+    """ collect the transaction.on_commit callbacks registered inside the block, and run them on exit if execute
+    A TestCase never commits, so this is how a test sees what happens once a change is committed, e.g. the
+    version stamps being bumped.
+    """
+    callbacks = []
+    start = len(connections[using].run_on_commit)
+    try:
+        yield callbacks
+    finally:
+        callbacks[:] = [func for savepoints, func in connections[using].run_on_commit[start:]]
+        if execute:
+            for callback in callbacks:
+                callback()
+
+
+SAVEPOINT_SQL = ('SAVEPOINT ', 'RELEASE SAVEPOINT ', 'ROLLBACK TO SAVEPOINT ')
+
+
+class QueryBudgetMixin(object):
+    """ a TestCase mixin to catch N+1 queries: an endpoint must run the same number of queries however many
+    rows it returns, and no more than its budget """
+
+    def count_queries(self, url, data=None):
+        """ GET the url and return the number of queries it ran, including those run while a streamed
+        response is read.  The savepoints ATOMIC_REQUESTS sets inside the test transaction are not counted. """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, data)
+            if getattr(response, 'streaming', False):
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200, 'GET {0} failed'.format(url))
+        return len([query for query in queries if not query['sql'].startswith(SAVEPOINT_SQL)])
+
+    def assertQueriesConstant(self, url, add_rows, data=None, sizes=(1, 5, 20), budget=None):
+        """ fail if the queries run for the url grow with the number of rows
+        :param add_rows: called with a number of rows to create before each request
+        :param sizes: the total number of rows in each request; keep them within one page
+        :param budget: optionally, the most queries the url may run
+        """
+        counts, created = [], 0
+        for size in sizes:
+            add_rows(size - created)
+            if not created:
+                # the first request fills the per process caches (sites, content types)
+                self.count_queries(url, data)
+            created = size
+            counts.append(self.count_queries(url, data))
+        self.assertEqual(len(set(counts)), 1,
+                         'GET {0} ran {1} queries for {2} rows'.format(url, counts, list(sizes)))
+        if budget is not None:
+            self.assertLessEqual(counts[0], budget, 'GET {0} ran more than {1} queries'.format(url, budget))
@@ -0,0 +1,137 @@
+"""
+Change stamps for conditional GET
+
+A scope is a named set of data, e.g. everything owned by one user.  Each scope has a stamp, the time it last
+changed, kept in the cache and bumped by the model signals of the apps once the change is committed.  The ETag
+and Last-Modified of a response are computed from the stamps of the scopes it was built from, so unchanged data
+is answered with a 304 before any query or serializer runs.
+"""
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial, wraps
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+def scope_key(scope):
+    return 'version:' + scope
+
+
+def owner_scope(app, owner_id):
+    """ the scope of the data of an app owned by one user """
+    return '{0}:owner:{1}'.format(app, owner_id)
+
+
+def get_stamp(scope):
+    """ the time in microseconds that the scope last changed.  A scope without a stamp, e.g. after the cache
+    was cleared, is treated as changed now """
+    stamp = cache.get(scope_key(scope))
+    if stamp is None:
+        cache.add(scope_key(scope), int(time.time() * 1e6), None)
+        stamp = cache.get(scope_key(scope))
+    return stamp
+
+
+# the scopes collected by bump_once in this thread
+_deferred = threading.local()
+
+
+def set_stamps(scopes):
+    stamp = int(time.time() * 1e6)
+    cache.set_many({scope_key(scope): stamp for scope in scopes}, None)
+
+
+def bump(*scopes):
+    """ record that the scopes have changed
+    The stamps are only moved when the transaction commits (at once outside of one): a request that read the old
+    stamp while the change was still uncommitted would otherwise cache the old data under the new stamp, where
+    it would be served until the next change.  If the transaction is rolled back the stamps are left alone.
+    """
+    deferred = getattr(_deferred, 'scopes', None)
+    if deferred is not None:
+        deferred.update(scopes)
+        return
+    transaction.on_commit(partial(set_stamps, scopes))
+
+
+def bumping_once():
+    """ whether the bumps of this thread are being collected by bump_once """
+    return getattr(_deferred, 'scopes', None) is not None
+
+
+@contextmanager
+def bump_once(*scopes):
+    """ collect the bumps made inside the block, e.g. by the model signals of a bulk delete, and bump each scope
+    once when it exits.  The scopes given are bumped as well: a bulk caller passes the scopes related to the
+    rows it changes, and the signal receivers leave out their per-instance lookups while bumping_once().
+    """
+    if bumping_once():
+        bump(*scopes)
+        yield
+        return
+    _deferred.scopes = set(scopes)
+    try:
+        yield
+    finally:
+        deferred, _deferred.scopes = _deferred.scopes, None
+        if deferred:
+            bump(*deferred)
+
+
+def validators(request, scopes):
+    """ the ETag and Last-Modified time of a response to the request built from the data of the scopes
+    The ETag also depends on the user, the full path and the accepted content types.
+    """
+    stamps = [get_stamp(scope) or 0 for scope in scopes]
+    user = getattr(request, 'user', None)
+    tag = hashlib.sha1(repr((stamps, getattr(user, 'pk', None), request.get_full_path(),
+                             request.META.get('HTTP_ACCEPT', ''))).encode()).hexdigest()
+    return quote_etag(tag), max(stamps) // 1000000
+
+
+def set_validators(response, etag, last_modified):
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Authorization', 'Cookie'))
+    return response
+
+
+def conditional(scopes_func):
+    """ decorate a view function with conditional GET
+    :param scopes_func: called with the view arguments, returns the scopes of the response
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            etag, last_modified = validators(request, scopes_func(request, *args, **kwargs))
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return set_validators(response, etag, last_modified)
+        return wrapper
+    return decorator
+
+
+class ConditionalGetMixin(object):
+    """ conditional GET for a rest framework view
+    The validators are checked after authentication, so they can depend on the request user.
+    Views set version_scopes or override get_version_scopes().
+    """
+    version_scopes = ()
+
+    def get_version_scopes(self):
+        return self.version_scopes
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = validators(request, self.get_version_scopes())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        return set_validators(response, etag, last_modified)
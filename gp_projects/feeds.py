@@ -0,0 +1,98 @@
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.gis.db.models import Collect
+from django.contrib.gis.db.models.functions import AsGeoJSON, Centroid, SnapToGrid
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count
+from geotabloid.versioning import get_stamp
+from .functions import Newest, zoom_tolerance
+from .models import usermap_scope
+
+
+# the same document layout as django's geojson serializer, so existing map clients are unaffected
+FEATURE_COLLECTION_START = '{"type": "FeatureCollection", ' \
+                           '"crs": {"type": "name", "properties": {"name": "EPSG:4326"}}, "features": ['
+FEATURE_COLLECTION_END = ']}'
+
+
+def geojson_rows(queryset, geometry, fields):
+    """ the rows of a geojson feed: the primary key, the geometry already encoded as GeoJSON by PostGIS,
+    and the property fields.  Rows are fetched from a server side cursor a chunk at a time.
+    :param queryset: the features to return
+    :param geometry: the geometry field, or an expression that returns a geometry
+    :param fields: names of the fields returned as feature properties
+    """
+    return queryset.annotate(geojson=AsGeoJSON(geometry)).values_list('pk', 'geojson', *fields) \
+        .iterator(chunk_size=settings.GEOJSON_FEED_CHUNK_SIZE)
+
+
+def stream_geojson(rows, fields):
+    """ generate a GeoJSON FeatureCollection from the rows of geojson_rows
+    The document is yielded in blocks of about settings.GEOJSON_FEED_BLOCK_SIZE characters, so the whole
+    collection is never held in memory and the first features reach the client straight away.
+    """
+    block = [FEATURE_COLLECTION_START]
+    size = len(FEATURE_COLLECTION_START)
+    separator = ''
+    for row in rows:
+        properties = dict(zip(fields, row[2:]))
+        properties['pk'] = str(row[0])
+        feature = '%s{"type": "Feature", "properties": %s, "geometry": %s}' % (
+            separator, json.dumps(properties, cls=DjangoJSONEncoder), row[1] or 'null')
+        separator = ', '
+        block.append(feature)
+        size += len(feature)
+        if size >= settings.GEOJSON_FEED_BLOCK_SIZE:
+            yield ''.join(block)
+            block = []
+            size = 0
+    block.append(FEATURE_COLLECTION_END)
+    yield ''.join(block)
+
+
+def cluster_rows(queryset, zoom, fields=(), timestamp_field='timestamp'):
+    """ the rows of a geojson feed of point clusters: the features are grouped in grid cells of
+    settings.CLUSTER_CELL_PIXELS at the zoom level by PostGIS. Each row is the newest feature of the cluster,
+    the centroid of the cluster as GeoJSON, the number of features and the fields of the newest feature.
+    :param queryset: the point features to cluster, on a 'location' field
+    :param zoom: the web map zoom level
+    :param fields: names of fields of the newest feature returned as properties
+    :param timestamp_field: the field that orders the features of a cluster, newest first
+    """
+    size = zoom_tolerance(zoom, settings.CLUSTER_CELL_PIXELS)
+    clusters = list(queryset.order_by().annotate(cell=SnapToGrid('location', size)).values('cell')
+                    .annotate(newest=Newest('pk', timestamp_field), count=Count('pk'),
+                              geojson=AsGeoJSON(Centroid(Collect('location'))))
+                    .values_list('newest', 'geojson', 'count'))
+    if not fields:
+        return clusters
+    values = {row[0]: row[1:] for row in queryset.model.objects.filter(pk__in=[c[0] for c in clusters])
+              .values_list('pk', *fields)}
+    return [cluster + values[cluster[0]] for cluster in clusters]
+
+
+def usermap_cache_key(usermap_id, feed, request):
+    """ the cache key of a UserMap feed for the request parameters.  The key includes the version of the map,
+    so a change to anything shown on the map moves its feeds to new keys.  The key is taken before the features
+    are read and the version only moves once a change is committed, so a document is never cached under a
+    version newer than the data it was built from. """
+    query = hashlib.md5(request.GET.urlencode().encode()).hexdigest()
+    return 'usermap:{0}:{1}:{2}:{3}'.format(usermap_id, get_stamp(usermap_scope(usermap_id)), feed, query)
+
+
+def cache_stream(key, blocks, timeout=None):
+    """ pass the blocks of a streamed feed through, then cache the whole document under the key
+    unless it is larger than settings.USERMAP_CACHE_MAX_SIZE characters """
+    content, size = [], 0
+    for block in blocks:
+        if content is not None:
+            size += len(block)
+            if size <= settings.USERMAP_CACHE_MAX_SIZE:
+                content.append(block)
+            else:
+                content = None
+        yield block
+    if content is not None:
+        cache.set(key, ''.join(content), settings.USERMAP_CACHE_TIMEOUT if timeout is None else timeout)
@@ -0,0 +1,78 @@
+import datetime
+import math
+from django.conf import settings
+from django.contrib.gis.geos import Point, Polygon
+from django.contrib.gis.measure import D
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ParseError
+from rest_framework.filters import BaseFilterBackend
+
+
+# metres per degree of latitude
+METRES_PER_DEGREE = 111320.0
+
+
+def parse_coordinates(value, count, name):
+    """ parse a comma separated list of count numbers """
+    try:
+        coordinates = [float(c) for c in value.split(',')]
+    except ValueError:
+        coordinates = []
+    if len(coordinates) != count:
+        raise ParseError('{0} must be {1} comma separated numbers'.format(name, count))
+    return coordinates
+
+
+def parse_timestamp(value, name):
+    """ parse an ISO 8601 date or datetime; naive values are in the current time zone """
+    try:
+        timestamp = parse_datetime(value)
+        if timestamp is None:
+            date = parse_date(value)
+            if date is not None:
+                timestamp = timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+    except ValueError:
+        timestamp = None
+    if timestamp is None:
+        raise ParseError('{0} must be an ISO 8601 date or date and time'.format(name))
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    return timestamp
+
+
+def spatial_temporal_filter(params, queryset, geometry_field=None, timestamp_field=None):
+    """ filter features by the query parameters
+        bbox=xmin,ymin,xmax,ymax  features intersecting the box (EPSG:4326)
+        near=lon,lat&dist=metres  features within dist (default settings.FILTER_NEAR_DISTANCE) of the point
+        since=, until=  features with a timestamp in the window (ISO 8601 dates or datetimes)
+    The spatial filters use the index on the geometry field, the time filters the index on the timestamp.
+    :raises ParseError: when a parameter is malformed
+    """
+    if geometry_field and params.get('bbox'):
+        bbox = parse_coordinates(params['bbox'], 4, 'bbox')
+        queryset = queryset.filter(**{geometry_field + '__intersects': Polygon.from_bbox(bbox)})
+    if geometry_field and params.get('near'):
+        lon, lat = parse_coordinates(params['near'], 2, 'near')
+        dist = parse_coordinates(params.get('dist') or str(settings.FILTER_NEAR_DISTANCE), 1, 'dist')[0]
+        point = Point(lon, lat, srid=4326)
+        # a search radius in degrees wide enough at this latitude selects the candidates from the index,
+        # then the exact distance in metres is checked
+        degrees = dist / METRES_PER_DEGREE / max(math.cos(math.radians(lat)), 0.01)
+        queryset = queryset.filter(**{geometry_field + '__dwithin': (point, degrees),
+                                      geometry_field + '__distance_lte': (point, D(m=dist))})
+    if timestamp_field and params.get('since'):
+        queryset = queryset.filter(**{timestamp_field + '__gte': parse_timestamp(params['since'], 'since')})
+    if timestamp_field and params.get('until'):
+        queryset = queryset.filter(**{timestamp_field + '__lte': parse_timestamp(params['until'], 'until')})
+    return queryset
+
+
+class SpatialTemporalFilter(BaseFilterBackend):
+    """ bbox=, near=/dist= and since=/until= filters for views that set
+    geometry_filter_field and/or timestamp_filter_field """
+
+    def filter_queryset(self, request, queryset, view):
+        return spatial_temporal_filter(request.query_params, queryset,
+                                       getattr(view, 'geometry_filter_field', None),
+                                       getattr(view, 'timestamp_filter_field', None))
@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.contrib.gis.db.models.functions import GeoFunc
+from django.db.models import Aggregate, Value
+from django.db.models.functions import Coalesce
+
+
+class SimplifyPreserveTopology(GeoFunc):
+    """ ST_SimplifyPreserveTopology(geometry, tolerance) - like Douglas-Peucker simplification,
+    but it never produces an invalid geometry """
+    function = 'ST_SimplifyPreserveTopology'
+
+
+class Newest(Aggregate):
+    """ the value of an expression for the newest row of each group, by a timestamp (ties go to the
+    largest value), e.g. Newest('pk', 'timestamp') """
+    def __init__(self, expression, timestamp, **extra):
+        super().__init__(expression, timestamp, **extra)
+
+    def _resolve_output_field(self):
+        return self.get_source_expressions()[0].output_field
+
+    def as_sql(self, compiler, connection, **extra_context):
+        value, timestamp = self.get_source_expressions()
+        value_sql, value_params = compiler.compile(value)
+        timestamp_sql, timestamp_params = compiler.compile(timestamp)
+        sql = '(array_agg({0} ORDER BY {1} DESC NULLS LAST, {0} DESC))[1]'.format(value_sql, timestamp_sql)
+        return sql, value_params + timestamp_params + value_params
+
+
+def zoom_tolerance(zoom, pixels=None):
+    """ the size in degrees of some pixels at the given web map zoom level, by default the simplification
+    tolerance that keeps a track accurate to settings.TRACK_SIMPLIFY_PIXELS """
+    if pixels is None:
+        pixels = settings.TRACK_SIMPLIFY_PIXELS
+    return pixels * 360.0 / (256 * 2 ** zoom)
+
+
+def request_zoom(request, default):
+    """ the web map zoom level of the zoom= query parameter """
+    try:
+        return min(max(int(request.GET.get('zoom', default)), 0), 30)
+    except ValueError:
+        return default
+
+
+def request_tolerance(request):
+    """ the simplification tolerance asked for by the zoom= or tolerance= (degrees) query parameter
+    :rtype: float, or None for full detail
+    """
+    try:
+        if 'tolerance' in request.GET:
+            return max(float(request.GET['tolerance']), 0) or None
+        if 'zoom' in request.GET:
+            return zoom_tolerance(min(max(int(request.GET['zoom']), 0), 30))
+    except ValueError:
+        pass
+    return None
+
+
+def simplified_track(tolerance):
+    """ an expression for the TrackFeature geometry simplified to the tolerance, computed by PostGIS.
+    At overview tolerances the stored overview geometry, which already has far fewer vertices,
+    is simplified instead of the full track.
+    :param tolerance: in degrees, None returns the full geometry
+    """
+    if not tolerance:
+        return 'linestring'
+    if tolerance >= zoom_tolerance(settings.TRACK_OVERVIEW_ZOOM):
+        return SimplifyPreserveTopology(Coalesce('linestring_overview', 'linestring'), Value(tolerance))
+    return SimplifyPreserveTopology('linestring', Value(tolerance))
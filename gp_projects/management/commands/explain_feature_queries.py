@@ -0,0 +1,96 @@
+""" show the PostgreSQL plans of the feature list queries and the retention task, with the indexes declared
+in the Meta of the feature models and with index scans turned off, e.g.
+
+    python manage.py explain_feature_queries --owner=someone --analyze
+
+The plans without the indexes are made with enable_indexscan, enable_indexonlyscan and enable_bitmapscan set
+off for one transaction.  Nothing is dropped or locked, so it is safe to run against a live database.
+"""
+import datetime
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from gp_projects.models import ImageNote, Note, TrackFeature
+from gp_projects.pagination import KeysetPagination
+
+FEATURE_MODELS = (Note, ImageNote, TrackFeature)
+# the planner settings that keep it from using any index
+INDEX_SCAN_SETTINGS = ('enable_indexscan', 'enable_indexonlyscan', 'enable_bitmapscan')
+
+
+def feature_queries(owner, page_size, interval):
+    """ the first page of each list endpoint for the owner, and the features CleanUpOldData deletes
+    :rtype: list of (name, queryset)
+    """
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=interval)
+    return [
+        ('notes', Note.objects.filter(owner=owner).order_by('-timestamp', '-id')[:page_size]),
+        ('imagenotes', ImageNote.objects.filter(owner=owner).order_by('-timestamp', '-id')[:page_size]),
+        ('tracks', TrackFeature.objects.filter(owner=owner).defer('linestring', 'linestring_overview')
+            .order_by('-timestamp_start', '-id')[:page_size]),
+        ('cleanup notes', Note.objects.filter(modifieddate__lt=cutoff).values('pk')),
+        ('cleanup imagenotes', ImageNote.objects.filter(modifieddate__lt=cutoff).values('pk')),
+        ('cleanup tracks', TrackFeature.objects.filter(modifieddate__lt=cutoff).values('pk')),
+    ]
+
+
+def feature_indexes():
+    """ the names of the indexes declared by the feature models, which must exist in the database """
+    names = []
+    with connection.cursor() as cursor:
+        for model in FEATURE_MODELS:
+            existing = connection.introspection.get_constraints(cursor, model._meta.db_table)
+            for index in model._meta.indexes:
+                if index.name not in existing:
+                    raise CommandError('index {0} does not exist, run migrate first'.format(index.name))
+                names.append(index.name)
+    return names
+
+
+def explain(queryset, analyze=False):
+    """ the lines of the plan of a queryset """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + sql if analyze else 'EXPLAIN ' + sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+class Command(BaseCommand):
+    help = 'Show the plans of the feature list and retention queries without index scans and with the feature indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owner',
+                            help='username whose features are listed (default: the owner of the newest note)')
+        parser.add_argument('--page-size', type=int, default=KeysetPagination.page_size)
+        parser.add_argument('--days', type=int, default=7, help='the retention interval of CleanUpOldData')
+        parser.add_argument('--analyze', action='store_true', help='run the queries and show the actual timings')
+
+    def handle(self, *args, **options):
+        if options['owner']:
+            try:
+                owner = get_user_model().objects.get(username=options['owner'])
+            except get_user_model().DoesNotExist:
+                raise CommandError('no user {0}'.format(options['owner']))
+        else:
+            owner = Note.objects.values_list('owner_id', flat=True).first()
+            if owner is None:
+                raise CommandError('there are no notes, give an --owner')
+        queries = feature_queries(owner, options['page_size'], options['days'])
+        indexes = feature_indexes()
+
+        # SET LOCAL lasts until the end of the transaction, or the savepoint when called inside one
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for setting in INDEX_SCAN_SETTINGS:
+                    cursor.execute('SET LOCAL {0} = off'.format(setting))
+            before = [explain(queryset, options['analyze']) for name, queryset in queries]
+            transaction.set_rollback(True)
+        after = [explain(queryset, options['analyze']) for name, queryset in queries]
+
+        self.stdout.write('indexes: {0}\n'.format(', '.join(indexes)))
+        for (name, queryset), without, plan in zip(queries, before, after):
+            self.stdout.write('== {0}: without index scans'.format(name))
+            self.stdout.write('\n'.join(without))
+            self.stdout.write('== {0}: with the indexes'.format(name))
+            self.stdout.write('\n'.join(plan))
+            self.stdout.write('')
@@ -0,0 +1,32 @@
+# Generated by Django 2.0.8 on 2026-10-18 12:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('gp_projects', '0012_imagenote_webimg'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device', models.CharField(blank=True, default='', max_length=200, verbose_name='Source project')),
+                ('notes_ts', models.BigIntegerField(default=0)),
+                ('gpslogs_ts', models.BigIntegerField(default=0)),
+                ('images_ts', models.BigIntegerField(default=0)),
+                ('modifieddate', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='ingestwatermark',
+            unique_together={('owner', 'device')},
+        ),
+    ]
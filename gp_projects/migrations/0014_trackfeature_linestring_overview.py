@@ -0,0 +1,25 @@
+# Generated by Django 2.0.8 on 2026-10-18 12:40
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gp_projects', '0013_ingestwatermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trackfeature',
+            name='linestring_overview',
+            field=django.contrib.gis.db.models.fields.LineStringField(blank=True, null=True, srid=4326),
+        ),
+        # fill in the overview for existing tracks, with the tolerance for the default TRACK_OVERVIEW_ZOOM (10)
+        migrations.RunSQL(
+            'UPDATE gp_projects_trackfeature '
+            'SET linestring_overview = ST_SimplifyPreserveTopology(linestring, 360.0 / (256 * 2 ^ 10));',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 2.0.8 on 2026-10-18 15:05
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gp_projects', '0014_trackfeature_linestring_overview'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trackfeature',
+            name='envelope',
+            field=django.contrib.gis.db.models.fields.PolygonField(blank=True, null=True, srid=4326, verbose_name='Bounding box'),
+        ),
+        migrations.AddField(
+            model_name='trackfeature',
+            name='centroid',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='trackfeature',
+            name='start_point',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='trackfeature',
+            name='end_point',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='trackfeature',
+            name='numpoints',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Number of points'),
+        ),
+        # fill in the summaries of existing tracks; the envelope is built from the extent because
+        # ST_Envelope returns a point or a line for a degenerate track
+        migrations.RunSQL(
+            'UPDATE gp_projects_trackfeature SET '
+            'envelope = ST_MakeEnvelope(ST_XMin(linestring), ST_YMin(linestring), '
+            'ST_XMax(linestring), ST_YMax(linestring), 4326), '
+            'centroid = ST_Centroid(linestring), '
+            'start_point = ST_StartPoint(linestring), '
+            'end_point = ST_EndPoint(linestring), '
+            'numpoints = ST_NPoints(linestring);',
+            migrations.RunSQL.noop,
+        ),
+    ]
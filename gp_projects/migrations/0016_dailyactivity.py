@@ -0,0 +1,50 @@
+# Generated by Django 2.0.8 on 2026-10-18 17:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('gp_projects', '0015_trackfeature_summary_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyActivity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('notes', models.IntegerField(default=0)),
+                ('images', models.IntegerField(default=0)),
+                ('tracks', models.IntegerField(default=0)),
+                ('track_length', models.DecimalField(decimal_places=3, default=0, max_digits=14, verbose_name='Track length in metres')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'daily activity',
+                'ordering': ('owner', '-date'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyactivity',
+            unique_together={('owner', 'date')},
+        ),
+        # roll up the existing features; the connection time zone is UTC, the same as TruncDate
+        migrations.RunSQL(
+            'INSERT INTO gp_projects_dailyactivity (owner_id, date, notes, images, tracks, track_length) '
+            'SELECT owner_id, date, sum(notes), sum(images), sum(tracks), sum(track_length) FROM ('
+            ' SELECT owner_id, timestamp::date AS date, count(*) AS notes, 0 AS images, 0 AS tracks,'
+            ' 0 AS track_length FROM gp_projects_note GROUP BY 1, 2'
+            ' UNION ALL'
+            ' SELECT owner_id, timestamp::date, 0, count(*), 0, 0 FROM gp_projects_imagenote GROUP BY 1, 2'
+            ' UNION ALL'
+            ' SELECT owner_id, timestamp_start::date, 0, 0, count(*), coalesce(sum(lengthm), 0)'
+            ' FROM gp_projects_trackfeature WHERE timestamp_start IS NOT NULL GROUP BY 1, 2'
+            ') AS activity GROUP BY owner_id, date;',
+            migrations.RunSQL.noop,
+        ),
+    ]
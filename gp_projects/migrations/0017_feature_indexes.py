@@ -0,0 +1,38 @@
+# Generated by Django 2.0.8 on 2026-10-18 18:25
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gp_projects', '0016_dailyactivity'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['owner', '-timestamp', '-id'], name='gp_note_owner_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['modifieddate'], name='gp_note_modified_brin'),
+        ),
+        migrations.AddIndex(
+            model_name='imagenote',
+            index=models.Index(fields=['owner', '-timestamp', '-id'], name='gp_imagenote_owner_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='imagenote',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['modifieddate'], name='gp_imagenote_modified_brin'),
+        ),
+        migrations.AddIndex(
+            model_name='trackfeature',
+            index=models.Index(fields=['owner', '-timestamp_start', '-id'], name='gp_track_owner_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trackfeature',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['modifieddate'], name='gp_track_modified_brin'),
+        ),
+    ]
@@ -1,11 +1,18 @@
 import os
 import json
+from django.conf import settings
 from django.contrib.gis.db import models
+from django.contrib.gis.geos import Point, Polygon
 from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import BrinIndex
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Greatest, TruncDate
+from django.utils import timezone
 from django.utils.safestring import mark_safe
-from django.db.models.signals import post_delete
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 from django.urls import reverse
+from geotabloid.versioning import bump, bump_once, bumping_once, owner_scope
 
 
 # Geopaparazzi user projects data
@@ -60,6 +67,12 @@ class Note(PointFeature):
     class Meta:
         ordering = ['-timestamp']
         unique_together = (("timestamp", "owner"),)
+        # the features are listed by owner, newest first; the retention task scans modifieddate,
+        # which grows with the table, so a small BRIN index covers it
+        indexes = [
+            models.Index(fields=['owner', '-timestamp', '-id'], name='gp_note_owner_ts_idx'),
+            BrinIndex(fields=['modifieddate'], name='gp_note_modified_brin'),
+        ]
 
 
 class ImageNote(PointFeature):
@@ -88,6 +101,10 @@ class ImageNote(PointFeature):
     class Meta:
         ordering = ['-timestamp']
         unique_together = (("timestamp", "owner"),)
+        indexes = [
+            models.Index(fields=['owner', '-timestamp', '-id'], name='gp_imagenote_owner_ts_idx'),
+            BrinIndex(fields=['modifieddate'], name='gp_imagenote_modified_brin'),
+        ]
 
 
 @receiver(post_delete, sender=ImageNote)
@@ -107,6 +124,14 @@ class TrackFeature(models.Model):
     linestring is stored as lat,lon - ht is ignored because the geodjango admin widgets don't support it
     """
     linestring = models.LineStringField(dim=2)
+    # a simplified copy of the track for overview maps, see TrackFeature.overview()
+    linestring_overview = models.LineStringField(dim=2, null=True, blank=True)
+    # small summaries of the linestring, so tracks can be listed and framed without loading it
+    envelope = models.PolygonField(null=True, blank=True, verbose_name="Bounding box")
+    centroid = models.PointField(null=True, blank=True)
+    start_point = models.PointField(null=True, blank=True)
+    end_point = models.PointField(null=True, blank=True)
+    numpoints = models.IntegerField(null=True, blank=True, verbose_name="Number of points")
     timestamp_start = models.DateTimeField(null=True, blank=True, verbose_name="Timestamp at start")
     timestamp_end = models.DateTimeField(null=True, blank=True, verbose_name="Timestamp at end")
     modifieddate = models.DateTimeField(auto_now_add=True)
@@ -118,12 +143,135 @@ class TrackFeature(models.Model):
     def __str__(self):
         return '{0} {1}'.format(self.owner, self.timestamp_start)
 
+    @staticmethod
+    def overview(linestring):
+        """ simplify a track for maps at settings.TRACK_OVERVIEW_ZOOM and below """
+        from .functions import zoom_tolerance
+        return linestring.simplify(zoom_tolerance(settings.TRACK_OVERVIEW_ZOOM), preserve_topology=True)
+
+    def update_geometry_fields(self):
+        """ fill in the overview and summary fields from the linestring
+        bulk_create does not call save(), so bulk loaders call this for each track """
+        self.linestring_overview = self.overview(self.linestring)
+        self.envelope = Polygon.from_bbox(self.linestring.extent)
+        self.envelope.srid = self.linestring.srid
+        self.centroid = self.linestring.centroid
+        self.start_point = Point(self.linestring[0], srid=self.linestring.srid)
+        self.end_point = Point(self.linestring[-1], srid=self.linestring.srid)
+        self.numpoints = self.linestring.num_points
+
+    def save(self, *args, **kwargs):
+        if self.linestring is not None:
+            self.update_geometry_fields()
+        super().save(*args, **kwargs)
+
     def url(self):
         return reverse('track-detail', args=[self.pk])
 
     class Meta:
         ordering = ['-timestamp_start']
         unique_together = (("timestamp_start", "owner"),)
+        indexes = [
+            models.Index(fields=['owner', '-timestamp_start', '-id'], name='gp_track_owner_ts_idx'),
+            BrinIndex(fields=['modifieddate'], name='gp_track_modified_brin'),
+        ]
+
+
+class IngestWatermark(models.Model):
+    """ the newest records loaded so far from one of an owner's geopaparazzi projects
+    timestamps are kept as geopaparazzi stores them (milliseconds since the epoch) so that they can be
+    compared directly with the project tables
+    """
+    owner = models.ForeignKey('users.user', to_field='id', on_delete=models.CASCADE)
+    device = models.CharField(max_length=200, blank=True, default='', verbose_name="Source project")
+    notes_ts = models.BigIntegerField(default=0)
+    gpslogs_ts = models.BigIntegerField(default=0)
+    images_ts = models.BigIntegerField(default=0)
+    modifieddate = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{0} {1}'.format(self.owner, self.device)
+
+    class Meta:
+        unique_together = (("owner", "device"),)
+
+
+# the timestamp that dates each feature model in the DailyActivity rollup, and the count it adds to
+ACTIVITY_FIELDS = {
+    Note: ('timestamp', 'notes'),
+    ImageNote: ('timestamp', 'images'),
+    TrackFeature: ('timestamp_start', 'tracks'),
+}
+
+
+class DailyActivity(models.Model):
+    """ the number of notes, images and tracks an owner recorded on each day, and the length of the tracks
+    The rollup is recomputed for the days touched by each userproject ingest and each saved feature, and
+    decremented as features are deleted, so summaries never have to scan the feature tables.
+    """
+    owner = models.ForeignKey('users.user', to_field='id', on_delete=models.CASCADE)
+    date = models.DateField()
+    notes = models.IntegerField(default=0)
+    images = models.IntegerField(default=0)
+    tracks = models.IntegerField(default=0)
+    track_length = models.DecimalField(max_digits=14, decimal_places=3, default=0,
+                                       verbose_name="Track length in metres")
+
+    def __str__(self):
+        return '{0} {1}'.format(self.owner, self.date)
+
+    @classmethod
+    def recompute(cls, owner_id, dates):
+        """ count the owner's features again for the dates (in the current time zone) """
+        dates = set(dates)
+        if not dates:
+            return
+        totals = {date: {'notes': 0, 'images': 0, 'tracks': 0, 'track_length': 0} for date in dates}
+        for model, (field, name) in ACTIVITY_FIELDS.items():
+            aggregates = {name: Count('id')}
+            if model is TrackFeature:
+                aggregates['track_length'] = Sum('lengthm')
+            rows = model.objects.filter(owner_id=owner_id, **{field + '__date__in': dates}) \
+                .annotate(date=TruncDate(field)).order_by().values('date').annotate(**aggregates)
+            for row in rows:
+                date = row.pop('date')
+                totals[date].update((key, value or 0) for key, value in row.items())
+        for date, values in totals.items():
+            if any(values.values()):
+                cls.objects.update_or_create(owner_id=owner_id, date=date, defaults=values)
+            else:
+                cls.objects.filter(owner_id=owner_id, date=date).delete()
+
+    @classmethod
+    def subtract(cls, owner_id, timestamp, **counts):
+        """ take deleted features off the day of the timestamp, never below zero """
+        if timestamp is None:
+            return
+        date = timezone.localtime(timestamp).date()
+        cls.objects.filter(owner_id=owner_id, date=date).update(
+            **{name: Greatest(F(name) - value, 0, output_field=cls._meta.get_field(name))
+               for name, value in counts.items()})
+
+    @classmethod
+    def days_of(cls, queryset):
+        """ the days of the features of a queryset, and of the images of its notes
+        :rtype: dict of owner id: set of dates
+        """
+        querysets = [queryset]
+        if queryset.model is Note:
+            querysets.append(ImageNote.objects.filter(note__in=queryset.values('pk')))
+        days = {}
+        for features in querysets:
+            field = ACTIVITY_FIELDS[features.model][0]
+            for owner_id, date in features.filter(**{field + '__isnull': False}).order_by() \
+                    .annotate(date=TruncDate(field)).values_list('owner_id', 'date').distinct():
+                days.setdefault(owner_id, set()).add(date)
+        return days
+
+    class Meta:
+        ordering = ('owner', '-date')
+        unique_together = (("owner", "date"),)
+        verbose_name_plural = "daily activity"
 
 
 # Additional classes for custom leaflet maps
@@ -194,5 +342,128 @@ class UserMap(models.Model):
     def image_json(self):
         return reverse('image-json-usermap',  kwargs={'pk': self.pk})
 
+    def image_cluster_json(self):
+        return reverse('image-cluster-usermap',  kwargs={'pk': self.pk})
+
+    def note_cluster_json(self):
+        return reverse('note-cluster-usermap',  kwargs={'pk': self.pk})
+
     def __str__(self):
         return self.description
+
+
+def bump_owner(owner_id):
+    """ record a change to the data of an owner, for conditional GET """
+    bump('gp_projects', owner_scope('gp_projects', owner_id))
+
+
+def usermap_scope(usermap_id):
+    """ the scope of everything shown on a UserMap, which versions its cached feeds """
+    return 'gp_projects:usermap:{0}'.format(usermap_id)
+
+
+def bump_usermaps(usermap_ids):
+    """ record a change to the content of some UserMaps, so their cached feeds are rebuilt """
+    bump(*[usermap_scope(pk) for pk in usermap_ids])
+
+
+# the UserMap many to many field of each feature model
+USERMAP_FIELDS = {Note: 'notes', ImageNote: 'images', TrackFeature: 'tracks'}
+
+
+def usermaps_showing(queryset):
+    """ the ids of the UserMaps showing any of the features of a queryset, or the images of its notes """
+    features = queryset.values('pk')
+    usermap_ids = set(UserMap.objects.filter(**{USERMAP_FIELDS[queryset.model] + '__in': features})
+                      .values_list('pk', flat=True))
+    if queryset.model is Note:
+        usermap_ids.update(UserMap.objects.filter(images__note__in=features).values_list('pk', flat=True))
+    return usermap_ids
+
+
+def delete_features(queryset):
+    """ delete Notes, ImageNotes or TrackFeatures in bulk, e.g. for the retention task.  The maps showing the
+    features are found in one query, and the owners and maps are bumped once instead of for every feature.
+    The DailyActivity of the days the features were on is recomputed once at the end. """
+    days = DailyActivity.days_of(queryset)
+    with bump_once(*[usermap_scope(pk) for pk in usermaps_showing(queryset)]):
+        deleted = queryset.delete()
+    for owner_id, dates in days.items():
+        DailyActivity.recompute(owner_id, dates)
+    return deleted
+
+
+@receiver(pre_delete, sender=Note)
+@receiver(pre_delete, sender=ImageNote)
+@receiver(pre_delete, sender=TrackFeature)
+def feature_pre_delete(sender, instance, **kwargs):
+    # the links to the maps are gone by post_delete; delete_features has already found the maps
+    if not bumping_once():
+        instance._usermap_ids = list(instance.usermap_set.values_list('pk', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Note)
+@receiver([post_save, post_delete], sender=ImageNote)
+@receiver([post_save, post_delete], sender=TrackFeature)
+@receiver([post_save, post_delete], sender=UserMap)
+def feature_changed(sender, instance, created=False, **kwargs):
+    bump_owner(instance.owner_id)
+    if sender is UserMap:
+        bump_usermaps([instance.pk])
+    elif hasattr(instance, '_usermap_ids'):
+        bump_usermaps(instance._usermap_ids)
+    elif not created and not bumping_once():
+        # a new feature is not on any map yet
+        bump_usermaps(instance.usermap_set.values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=UserMap.tracks.through)
+@receiver(m2m_changed, sender=UserMap.notes.through)
+@receiver(m2m_changed, sender=UserMap.images.through)
+@receiver(m2m_changed, sender=UserMap.tilelayer.through)
+def usermap_features_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            bump_usermaps([instance.pk])
+    elif action == 'pre_clear':
+        # a feature or tile layer is about to be removed from all of its maps
+        instance._usermap_ids = list(instance.usermap_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        bump_usermaps(instance._usermap_ids)
+    elif action.startswith('post_'):
+        # a feature or tile layer was added to or removed from some maps
+        bump_usermaps(pk_set)
+
+
+@receiver(pre_save, sender=Note)
+@receiver(pre_save, sender=ImageNote)
+@receiver(pre_save, sender=TrackFeature)
+def feature_activity_pre_save(sender, instance, raw=False, **kwargs):
+    # an edit may move the feature to another day
+    if instance.pk is not None and not raw:
+        field = ACTIVITY_FIELDS[sender][0]
+        instance._activity_timestamp = sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+
+
+@receiver(post_save, sender=Note)
+@receiver(post_save, sender=ImageNote)
+@receiver(post_save, sender=TrackFeature)
+def feature_activity_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    timestamps = (getattr(instance, ACTIVITY_FIELDS[sender][0]), instance.__dict__.pop('_activity_timestamp', None))
+    DailyActivity.recompute(instance.owner_id, {timezone.localtime(ts).date() for ts in timestamps if ts})
+
+
+@receiver(post_delete, sender=Note)
+@receiver(post_delete, sender=ImageNote)
+@receiver(post_delete, sender=TrackFeature)
+def feature_activity_post_delete(sender, instance, **kwargs):
+    # delete_features recomputes the days of a bulk delete itself
+    if bumping_once():
+        return
+    field, name = ACTIVITY_FIELDS[sender]
+    counts = {name: 1}
+    if sender is TrackFeature:
+        counts['track_length'] = instance.lengthm or 0
+    DailyActivity.subtract(instance.owner_id, getattr(instance, field), **counts)
@@ -0,0 +1,113 @@
+from collections import OrderedDict
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+def approximate_count(queryset):
+    """ the number of rows the PostgreSQL planner expects the queryset to return, which costs no scan """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPagination(CursorPagination):
+    """ cursor pagination on the (timestamp, id) of the features: each page continues from the last row of the
+    previous one, so deep pages cost the same as the first.  No total is counted unless count=approx is given,
+    then the planner estimate is returned.
+    The rest framework cursor only keys on the first field of the ordering, and steps over rows that share
+    it with an offset; here the position of a row is both fields, so it is unique.  Rows without a timestamp
+    sort where PostgreSQL puts NULLs - after every timestamp, so first in descending order.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    count_query_param = 'count'
+
+    def __init__(self, ordering):
+        """ :param ordering: the timestamp and the unique key, both ascending or both descending """
+        self.ordering = tuple(ordering)
+        self.count = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get(self.count_query_param) == 'approx':
+            self.count = approximate_count(queryset.order_by())
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, position = self.cursor or (0, False, None)
+
+        if reverse:
+            queryset = queryset.order_by(*[name[1:] if name.startswith('-') else '-' + name
+                                           for name in self.ordering])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.following(position, reverse))
+            except (ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        # one row more than the page tells whether there is a page after it
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following = None
+        if len(results) > len(self.page):
+            following = self._get_position_from_instance(results[-1], self.ordering)
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None or offset > 0
+            self.has_previous = following is not None
+            self.next_position, self.previous_position = position, following
+        else:
+            self.has_next = following is not None
+            self.has_previous = position is not None or offset > 0
+            self.next_position, self.previous_position = following, position
+        self.display_page_controls = (self.has_previous or self.has_next) and self.template is not None
+        return self.page
+
+    def _get_position_from_instance(self, instance, ordering):
+        """ the key and the timestamp of the row, the timestamp is left empty when it is NULL """
+        field, key = (name.lstrip('-') for name in ordering)
+        value = getattr(instance, field)
+        return '{0} {1}'.format(getattr(instance, key), '' if value is None else value)
+
+    def following(self, position, reverse):
+        """ the filter for the rows after the position in the order of the pages, before it for a reverse cursor
+        The comparisons bound the timestamp on its own as well, so the (owner, timestamp, id) index is used. """
+        field, key = (name.lstrip('-') for name in self.ordering)
+        pk, value = position.split(' ', 1)
+        if self.ordering[0].startswith('-') != reverse:  # the rows with smaller values, NULL is above every value
+            if not value:
+                return Q(**{field + '__isnull': False}) | Q(**{field + '__isnull': True, key + '__lt': pk})
+            return Q(**{field + '__lte': value}) & (Q(**{field + '__lt': value}) | Q(**{key + '__lt': pk}))
+        if not value:
+            return Q(**{field + '__isnull': True, key + '__gt': pk})
+        return Q(**{field + '__isnull': True}) | Q(**{field + '__gt': value}) | Q(**{field: value, key + '__gt': pk})
+
+    def get_paginated_response(self, data):
+        response = OrderedDict([('next', self.get_next_link()), ('previous', self.get_previous_link())])
+        if self.count is not None:
+            response['count'] = self.count
+        response['results'] = data
+        return Response(response)
+
+
+class KeysetPaginationMixin(object):
+    """ use KeysetPagination for requests with cursor= or pagination=cursor, and the default pagination
+    (datatables) otherwise.  Views set keyset_ordering, the timestamp field and the primary key to page on """
+    keyset_ordering = ('-timestamp', '-id')
+
+    @property
+    def paginator(self):
+        params = self.request.query_params
+        if not hasattr(self, '_paginator') and ('cursor' in params or params.get('pagination') == 'cursor'):
+            self._paginator = KeysetPagination(self.keyset_ordering)
+        return super().paginator
@@ -0,0 +1,112 @@
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import geobuf
+except ImportError:  # the binary geobuf format is only offered when the package is installed
+    geobuf = None
+
+
+def request_precision(renderer_context, default):
+    """ the number of decimal places asked for by the precision= query parameter """
+    request = renderer_context.get('request') if renderer_context else None
+    try:
+        return min(max(int(request.query_params.get('precision', default)), 0), 15)
+    except (AttributeError, ValueError):
+        return default
+
+
+def map_geometries(data, func):
+    """ replace the coordinates of every GeoJSON geometry in the data by func(coordinates) """
+    if isinstance(data, dict):
+        if 'coordinates' in data and 'type' in data:
+            return dict(data, coordinates=func(data['coordinates']))
+        return {key: map_geometries(value, func) for key, value in data.items()}
+    if isinstance(data, list):
+        return [map_geometries(value, func) for value in data]
+    return data
+
+
+def round_coordinates(coordinates, precision):
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        return [round(c, precision) for c in coordinates]
+    return [round_coordinates(c, precision) for c in coordinates]
+
+
+def encode_polyline(positions, precision=5):
+    """ encode a list of GeoJSON (lon, lat) positions with the Google encoded polyline algorithm,
+    which stores the points as lat, lon """
+    factor = 10 ** precision
+    encoded = []
+    previous = (0, 0)
+    for position in positions:
+        point = (int(round(position[1] * factor)), int(round(position[0] * factor)))
+        for delta in (point[0] - previous[0], point[1] - previous[1]):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                encoded.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            encoded.append(chr(value + 63))
+        previous = point
+    return ''.join(encoded)
+
+
+def encode_coordinates(coordinates, precision):
+    """ a Point becomes one encoded string, a LineString one string, and deeper geometries lists of strings """
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        return encode_polyline([coordinates], precision)
+    if coordinates and isinstance(coordinates[0][0], (int, float)):
+        return encode_polyline(coordinates, precision)
+    return [encode_coordinates(c, precision) for c in coordinates]
+
+
+class PrecisionGeoJSONRenderer(JSONRenderer):
+    """ GeoJSON with the coordinates rounded to precision= decimal places,
+    by default settings.GEOJSON_PRECISION (6 places is about 10cm) """
+    media_type = 'application/geo+json'
+    format = 'geojson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        precision = request_precision(renderer_context, settings.GEOJSON_PRECISION)
+        data = map_geometries(data, lambda coordinates: round_coordinates(coordinates, precision))
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class PolylineRenderer(JSONRenderer):
+    """ GeoJSON with the coordinates of each geometry replaced by a Google encoded polyline string,
+    with precision= decimal places (default 5) """
+    media_type = 'application/vnd.geotabloid.polyline+json'
+    format = 'polyline'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        precision = request_precision(renderer_context, 5)
+        data = map_geometries(data, lambda coordinates: encode_coordinates(coordinates, precision))
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class GeobufRenderer(BaseRenderer):
+    """ the binary Geobuf encoding of the GeoJSON, with precision= decimal places,
+    by default settings.GEOJSON_PRECISION.  Paginated lists are encoded without the page links.
+    Error responses, and anything else that is not a GeoJSON feature, are sent as JSON """
+    media_type = 'application/x-protobuf'
+    format = 'pbf'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = renderer_context.get('response') if renderer_context else None
+        if isinstance(data, dict) and 'results' in data:
+            data = data['results']
+        failed = response is not None and response.status_code >= 400
+        if failed or not (isinstance(data, dict) and data.get('type') in ('Feature', 'FeatureCollection')):
+            # the content type was set from this renderer before it was called
+            if response is not None:
+                response['Content-Type'] = JSONRenderer.media_type
+            return JSONRenderer().render(data)
+        return geobuf.encode(data, request_precision(renderer_context, settings.GEOJSON_PRECISION))
+
+
+# the renderers added to the default ones for the geometry endpoints
+COMPACT_RENDERERS = [PrecisionGeoJSONRenderer, PolylineRenderer]
+if geobuf is not None:
+    COMPACT_RENDERERS.append(GeobufRenderer)
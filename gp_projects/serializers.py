@@ -11,6 +11,7 @@ class TrackFeatureSerializer(GeoFeatureModelSerializer):
     class Meta:
         model = TrackFeature
         geo_field = "linestring"
+        bbox_geo_field = "envelope"
 
         # you can also explicitly declare which fields you want to include
         # as with a ModelSerializer.
@@ -39,13 +40,17 @@ class NGImageNoteSerializer(serializers.ModelSerializer):
 
 
 class NGTrackFeatureSerializer(serializers.ModelSerializer):
-    """ A class to serialize Tracks without the geo bits """
+    """ A class to serialize Tracks without the geo bits, but with the bounding box to frame them """
     timestamp_start = serializers.DateTimeField(format='%Y-%m-%d %X')
     timestamp_end = serializers.DateTimeField(format='%Y-%m-%d %X')
+    bbox = serializers.SerializerMethodField()
 
     class Meta:
         model = TrackFeature
-        fields = ('id', 'timestamp_start', 'timestamp_end', 'owner', 'text', 'lengthm')
+        fields = ('id', 'timestamp_start', 'timestamp_end', 'owner', 'text', 'lengthm', 'numpoints', 'bbox')
+
+    def get_bbox(self, obj):
+        return obj.envelope.extent if obj.envelope else None
 
 
 class ImageUrlField(serializers.RelatedField):
@@ -1,5 +1,5 @@
 import datetime
-from .models import Note, ImageNote, TrackFeature
+from .models import Note, ImageNote, TrackFeature, delete_features
 from geotabloid.taskapp.celery import app
 # from celery import shared_task
 
@@ -18,8 +18,8 @@ def CleanUpOldData(interval):
     cuttracks = TrackFeature.objects.filter(modifieddate__lt=cutoff)
 
     print("Deleting {0} Notes, {1} Images and {2} Tracks".format(cutnotes.count(), cutimagenotes.count(), cuttracks.count()))
-    cutnotes.delete()  # deleting the notes should automatically delete the imagenotes
-    cuttracks.delete()
+    delete_features(cutnotes)  # deleting the notes should automatically delete the imagenotes
+    delete_features(cuttracks)
 
 # @app.on_after_configure.connect
 # def setup_periodic_tasks(sender, **kwargs):
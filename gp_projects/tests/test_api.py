@@ -8,6 +8,8 @@ from django.core.exceptions import ObjectDoesNotExist
 import tempfile
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import override_settings
+from django.contrib.gis.geos import Point
+import datetime
 from geotabloid.users.tests.factories import UserFactory
 
 
@@ -23,3 +25,72 @@ class ImageNoteAPITestCase(APITestCase):
         self.tempfile = tempfile.NamedTemporaryFile()
         self.document = SimpleUploadedFile(self.tempfile.name, b'some example data for our file')
         self.imagenote = ImageNote.objects.create(lat=52, lon=-113 )
+
+
+class NoteFilterAPITestCase(APITestCase):
+    def setUp(self):
+        self.user1 = UserFactory.build()
+        self.user1.save()
+        self.client.force_authenticate(user=self.user1)
+        for i, (lon, lat) in enumerate([(-114.38, 52.12), (-114.39, 52.13), (-100.0, 45.0)]):
+            Note.objects.create(location=Point(lon, lat), lat=lat, lon=lon, altitude=1000, owner=self.user1,
+                                timestamp=datetime.datetime(2018, 5, 10 + i, tzinfo=datetime.timezone.utc))
+
+    def get_notes(self, **params):
+        response = self.client.get(reverse('note-list'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['results']
+
+    def test_bbox(self):
+        self.assertEqual(len(self.get_notes()), 3)
+        self.assertEqual(len(self.get_notes(bbox='-115,52,-114,53')), 2)
+
+    def test_near(self):
+        self.assertEqual(len(self.get_notes(near='-114.38,52.12', dist='100')), 1)
+        self.assertEqual(len(self.get_notes(near='-114.38,52.12', dist='5000')), 2)
+
+    def test_time_window(self):
+        self.assertEqual(len(self.get_notes(since='2018-05-11')), 2)
+        self.assertEqual(len(self.get_notes(since='2018-05-11', until='2018-05-11T12:00:00Z')), 1)
+
+    def test_cursor_pagination(self):
+        response = self.client.get(reverse('note-list'), {'pagination': 'cursor', 'page_size': 2, 'count': 'approx'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('count', response.data)
+        first = [note['id'] for note in response.data['results']]
+        self.assertEqual(len(first), 2)
+        response = self.client.get(response.data['next'])
+        second = [note['id'] for note in response.data['results']]
+        self.assertEqual(len(second), 1)
+        self.assertEqual(first + second, list(Note.objects.order_by('-timestamp', '-id').values_list('id', flat=True)))
+        self.assertIsNone(response.data['next'])
+
+    def test_cursor_pagination_null_timestamps(self):
+        # notes without a timestamp come first, and the second page starts part way through them
+        for i in range(3):
+            Note.objects.create(location=Point(-114.38, 52.12), lat=52.12, lon=-114.38, altitude=1000,
+                                owner=self.user1)
+        expected = list(Note.objects.filter(timestamp__isnull=True).order_by('-id').values_list('id', flat=True)) + \
+            list(Note.objects.filter(timestamp__isnull=False).order_by('-timestamp').values_list('id', flat=True))
+        pages = []
+        response = self.client.get(reverse('note-list'), {'pagination': 'cursor', 'page_size': 2})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append([note['id'] for note in response.data['results']])
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual([len(page) for page in pages], [2, 2, 2])
+        # and back again
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([note['id'] for note in response.data['results']], pages[1])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([note['id'] for note in response.data['results']], pages[0])
+        self.assertIsNone(response.data['previous'])
+
+    def test_bad_parameters(self):
+        response = self.client.get(reverse('note-list'), {'bbox': '1,2,3'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('note-list'), {'since': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,32 @@
+import datetime
+from io import StringIO
+from django.contrib.gis.geos import Point
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from geotabloid.users.tests.factories import UserFactory
+from ..models import Note
+
+
+class ExplainFeatureQueriesTestCase(TestCase):
+    def setUp(self):
+        self.owner = UserFactory.build()
+        self.owner.save()
+        Note.objects.create(location=Point(-114.38, 52.12), lat=52.12, lon=-114.38, altitude=1105.5,
+                            timestamp=datetime.datetime.now(tz=datetime.timezone.utc),
+                            owner=self.owner, description='POI', text='Test text here')
+
+    def test_plans(self):
+        out = StringIO()
+        call_command('explain_feature_queries', owner=self.owner.username, stdout=out)
+        output = out.getvalue()
+        self.assertIn('gp_note_owner_ts_idx', output)
+        for name in ('notes', 'imagenotes', 'tracks', 'cleanup notes', 'cleanup imagenotes', 'cleanup tracks'):
+            self.assertIn('== {0}: without index scans'.format(name), output)
+            self.assertIn('== {0}: with the indexes'.format(name), output)
+
+    def test_planner_settings_restored(self):
+        call_command('explain_feature_queries', stdout=StringIO())
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW enable_indexscan')
+            self.assertEqual(cursor.fetchone()[0], 'on')
@@ -1,13 +1,15 @@
 from django.test import TestCase
 from django.urls import reverse
 import datetime
-from ..models import Note, ImageNote, TrackFeature
+from ..models import DailyActivity, Note, ImageNote, TrackFeature, UserMap, delete_features, usermap_scope
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.gis.geos import Point, LineString
 import tempfile
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import override_settings
 from geotabloid.users.tests.factories import UserFactory
+from geotabloid.testing import capture_on_commit_callbacks
+from geotabloid.versioning import get_stamp, owner_scope
 
 
 # Some tests of the various models for the geopaparazzi user project services
@@ -63,3 +65,96 @@ class TestTrackFeature(TestCase):
 
     def test_create_track(self):
         self.assertIsInstance(self.trackfeature, TrackFeature)
+
+    def test_summary_fields(self):
+        track = TrackFeature.objects.get(pk=self.trackfeature.pk)
+        self.assertEqual(track.numpoints, 4)
+        self.assertEqual(track.envelope.extent, self.linestring.extent)
+        self.assertEqual(track.start_point.coords, (-114.38, 52.12))
+        self.assertEqual(track.end_point.coords, (-114.386, 52.119))
+        self.assertTrue(track.envelope.contains(track.centroid))
+
+
+class TestDailyActivity(TestCase):
+    def setUp(self):
+        self.owner = UserFactory.build()
+        self.owner.save()
+        self.timestamp = datetime.datetime(2018, 11, 20, 15, 30, tzinfo=datetime.timezone.utc)
+        for minute in range(3):
+            Note.objects.create(location=Point(-114.38, 52.12), lat=52.12, lon=-114.38, altitude=1105.5,
+                                timestamp=self.timestamp + datetime.timedelta(minutes=minute),
+                                owner=self.owner, description='POI', text='note {0}'.format(minute))
+        self.track = TrackFeature.objects.create(linestring=LineString(Point(-114.38, 52.12), Point(-114.381, 52.123)),
+                                                 owner=self.owner, timestamp_start=self.timestamp,
+                                                 timestamp_end=self.timestamp, text='track')
+
+    def test_recompute(self):
+        DailyActivity.recompute(self.owner.pk, [self.timestamp.date()])
+        activity = DailyActivity.objects.get(owner=self.owner)
+        self.assertEqual(activity.date, self.timestamp.date())
+        self.assertEqual((activity.notes, activity.images, activity.tracks), (3, 0, 1))
+        self.assertEqual(activity.track_length, TrackFeature.objects.get(pk=self.track.pk).lengthm or 0)
+
+    def test_delete(self):
+        DailyActivity.recompute(self.owner.pk, [self.timestamp.date()])
+        Note.objects.filter(owner=self.owner).first().delete()
+        self.track.delete()
+        activity = DailyActivity.objects.get(owner=self.owner)
+        self.assertEqual((activity.notes, activity.tracks, activity.track_length), (2, 0, 0))
+
+    def test_saved_outside_ingest(self):
+        # features created through the api or the admin are counted as they are saved
+        activity = DailyActivity.objects.get(owner=self.owner, date=self.timestamp.date())
+        self.assertEqual((activity.notes, activity.images, activity.tracks), (3, 0, 1))
+        # an edit moves the feature to its new day
+        self.track.timestamp_start = self.timestamp + datetime.timedelta(days=1)
+        self.track.save()
+        activity.refresh_from_db()
+        self.assertEqual(activity.tracks, 0)
+        self.assertEqual(DailyActivity.objects.get(owner=self.owner, date=self.track.timestamp_start.date()).tracks, 1)
+        Note.objects.filter(owner=self.owner).first().delete()
+        activity.refresh_from_db()
+        self.assertEqual(activity.notes, 2)
+
+    def test_subtract_stops_at_zero(self):
+        DailyActivity.subtract(self.owner.pk, self.timestamp, notes=5, track_length=1000)
+        activity = DailyActivity.objects.get(owner=self.owner, date=self.timestamp.date())
+        self.assertEqual((activity.notes, activity.track_length), (0, 0))
+
+    def test_delete_features(self):
+        delete_features(Note.objects.filter(owner=self.owner))
+        activity = DailyActivity.objects.get(owner=self.owner, date=self.timestamp.date())
+        self.assertEqual((activity.notes, activity.tracks), (0, 1))
+
+    def test_recompute_empty_day(self):
+        DailyActivity.recompute(self.owner.pk, [self.timestamp.date()])
+        Note.objects.filter(owner=self.owner).delete()
+        self.track.delete()
+        DailyActivity.recompute(self.owner.pk, [self.timestamp.date()])
+        self.assertFalse(DailyActivity.objects.filter(owner=self.owner).exists())
+
+
+class TestDeleteFeatures(TestCase):
+    def setUp(self):
+        self.owner = UserFactory.build()
+        self.owner.save()
+        self.usermap = UserMap.objects.create(slug='test', description='test map', center=Point(-114.38, 52.12),
+                                              owner=self.owner)
+        for minute in range(3):
+            self.usermap.notes.add(Note.objects.create(
+                location=Point(-114.38, 52.12), lat=52.12, lon=-114.38, altitude=1105.5, owner=self.owner,
+                timestamp=datetime.datetime(2018, 11, 20, 15, minute, tzinfo=datetime.timezone.utc)))
+
+    def test_delete_features(self):
+        before = get_stamp(usermap_scope(self.usermap.pk))
+        with capture_on_commit_callbacks() as callbacks:
+            delete_features(Note.objects.filter(owner=self.owner))
+        self.assertFalse(Note.objects.filter(owner=self.owner).exists())
+        # the stamps are not moved until the delete is committed, and then only once
+        self.assertEqual(get_stamp(usermap_scope(self.usermap.pk)), before)
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        after = get_stamp(usermap_scope(self.usermap.pk))
+        self.assertGreater(after, before)
+        # the owner and the map are bumped together, once for the whole delete
+        self.assertEqual(after, get_stamp(owner_scope('gp_projects', self.owner.pk)))
@@ -0,0 +1,67 @@
+import datetime
+from django.contrib.gis.geos import LineString, Point
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from ..models import ImageNote, Note, TrackFeature, UserMap
+from geotabloid.testing import QueryBudgetMixin
+from geotabloid.users.tests.factories import UserFactory
+
+
+# the list endpoints must not run a query per row
+class ListQueriesTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user1 = UserFactory.build()
+        self.user1.save()
+        self.client.force_authenticate(user=self.user1)
+        self.usermap = UserMap.objects.create(slug='test', description='test map', center=Point(-114.38, 52.12),
+                                              owner=self.user1)
+        self.minutes = 0
+
+    def timestamp(self):
+        self.minutes += 1
+        return datetime.datetime(2018, 5, 10, tzinfo=datetime.timezone.utc) + datetime.timedelta(minutes=self.minutes)
+
+    def add_notes(self, count):
+        for i in range(count):
+            note = Note.objects.create(location=Point(-114.38, 52.12), lat=52.12, lon=-114.38, altitude=1000,
+                                       owner=self.user1, timestamp=self.timestamp(), form='{"forms": []}')
+            for j in range(2):
+                image = ImageNote.objects.create(location=Point(-114.38, 52.12), lat=52.12, lon=-114.38,
+                                                 altitude=1000, owner=self.user1, note=note,
+                                                 timestamp=self.timestamp(), image='image.jpg',
+                                                 thumbnail='thumbnail.jpg', webimg='webimg.jpg')
+                self.usermap.images.add(image)
+
+    def add_tracks(self, count):
+        for i in range(count):
+            track = TrackFeature.objects.create(linestring=LineString((-114.38, 52.12), (-114.381, 52.123)),
+                                                owner=self.user1, timestamp_start=self.timestamp())
+            self.usermap.tracks.add(track)
+
+    def test_notes(self):
+        self.assertQueriesConstant(reverse('note-list'), self.add_notes)
+
+    def test_notes_datatables(self):
+        self.assertQueriesConstant(reverse('note-list'), self.add_notes, data={'format': 'datatables'})
+
+    def test_images(self):
+        self.assertQueriesConstant(reverse('imagenote-list'), self.add_notes)
+        self.assertQueriesConstant(reverse('imagenote-gj-list'), self.add_notes)
+
+    def test_userview(self):
+        # a plain django view, authenticated by the session
+        self.client.force_login(self.user1)
+        self.assertQueriesConstant(reverse('user-view'), self.add_notes)
+
+    def test_tracks(self):
+        self.assertQueriesConstant(reverse('trackfeature-list'), self.add_tracks, data={'pagination': 'cursor'})
+
+    @override_settings(USERMAP_CACHE_MAX_SIZE=0)
+    def test_usermap_feeds(self):
+        # with nothing cached, each feed is one query for the map and one for the features, which are read
+        # while the response streams
+        self.assertQueriesConstant(reverse('track-json-usermap', kwargs={'pk': self.usermap.pk}), self.add_tracks,
+                                   budget=2)
+        self.assertQueriesConstant(reverse('image-json-usermap', kwargs={'pk': self.usermap.pk}), self.add_notes,
+                                   budget=2)
@@ -0,0 +1,67 @@
+import datetime
+import json
+from unittest import skipIf
+from django.test import TestCase
+from django.contrib.gis.geos import LineString
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from rest_framework import status
+from ..models import TrackFeature
+from ..renderers import encode_polyline, encode_coordinates, geobuf, PrecisionGeoJSONRenderer
+from geotabloid.users.tests.factories import UserFactory
+
+
+class TestPolyline(TestCase):
+    def test_encode(self):
+        # the example from the Google encoded polyline documentation
+        positions = [(-120.2, 38.5), (-120.95, 40.7), (-126.453, 43.252)]
+        self.assertEqual(encode_polyline(positions), '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+
+    def test_encode_geometries(self):
+        self.assertEqual(encode_coordinates([-120.2, 38.5], 5), '_p~iF~ps|U')
+        self.assertEqual(encode_coordinates([[[-120.2, 38.5]]], 5), ['_p~iF~ps|U'])
+
+
+class TestPrecisionGeoJSON(TestCase):
+    def test_round(self):
+        data = {'type': 'Feature', 'properties': {'lengthm': 1.23456789},
+                'geometry': {'type': 'LineString', 'coordinates': [[-114.123456789, 52.987654321], [1, 2]]}}
+        rendered = json.loads(PrecisionGeoJSONRenderer().render(data, renderer_context={}).decode())
+        self.assertEqual(rendered['geometry']['coordinates'], [[-114.123457, 52.987654], [1, 2]])
+        self.assertEqual(rendered['properties']['lengthm'], 1.23456789)
+
+
+class TrackFormatTestCase(APITestCase):
+    def setUp(self):
+        self.user1 = UserFactory.build()
+        self.user1.save()
+        self.client.force_authenticate(user=self.user1)
+        self.track = TrackFeature.objects.create(
+            linestring=LineString((-120.2, 38.5), (-120.95, 40.7), (-126.453, 43.252)), owner=self.user1,
+            timestamp_start=datetime.datetime(2018, 5, 10, 12, tzinfo=datetime.timezone.utc))
+
+    def test_polyline(self):
+        response = self.client.get(reverse('track-detail', kwargs={'pk': self.track.pk}), {'format': 'polyline'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(response.content.decode())
+        self.assertEqual(data['geometry']['coordinates'], '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+
+    def test_precision(self):
+        response = self.client.get(reverse('track-detail', kwargs={'pk': self.track.pk}),
+                                   {'format': 'geojson', 'precision': 1})
+        data = json.loads(response.content.decode())
+        self.assertEqual(data['geometry']['coordinates'][2], [-126.5, 43.3])
+
+    @skipIf(geobuf is None, 'geobuf is not installed')
+    def test_geobuf(self):
+        response = self.client.get(reverse('track-detail', kwargs={'pk': self.track.pk}), {'format': 'pbf'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-protobuf')
+        self.assertEqual(geobuf.decode(response.content)['geometry']['type'], 'LineString')
+
+    @skipIf(geobuf is None, 'geobuf is not installed')
+    def test_geobuf_error_is_json(self):
+        response = self.client.get(reverse('track-detail', kwargs={'pk': self.track.pk + 1}), {'format': 'pbf'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('detail', json.loads(response.content.decode()))
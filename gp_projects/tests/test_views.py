@@ -0,0 +1,169 @@
+import datetime
+import json
+from rest_framework.test import APITestCase
+from rest_framework import status
+from django.contrib.gis.geos import Point, LineString
+from django.urls import reverse
+from ..models import Note, TrackFeature, UserMap
+from ..feeds import stream_geojson
+from ..tiles import tile_envelope, WORLD_ORIGIN
+from geotabloid.testing import capture_on_commit_callbacks
+from geotabloid.users.tests.factories import UserFactory
+
+
+class GeojsonFeedTestCase(APITestCase):
+    def setUp(self):
+        self.user1 = UserFactory.build()
+        self.user1.save()
+        self.usermap = UserMap.objects.create(slug='test', description='test map', center=Point(-114.38, 52.12),
+                                              owner=self.user1)
+        for i in range(3):
+            track = TrackFeature.objects.create(
+                linestring=LineString((-114.38, 52.12), (-114.381, 52.123 + i)), owner=self.user1,
+                timestamp_start=datetime.datetime(2018, 5, 10, 12, i, tzinfo=datetime.timezone.utc))
+            self.usermap.tracks.add(track)
+
+    def test_track_feed(self):
+        response = self.client.get(reverse('track-json-usermap', kwargs={'pk': self.usermap.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(b''.join(response.streaming_content).decode())
+        self.assertEqual(data['type'], 'FeatureCollection')
+        self.assertEqual(len(data['features']), 3)
+        feature = data['features'][0]
+        self.assertEqual(feature['geometry']['type'], 'LineString')
+        self.assertIn('timestamp_start', feature['properties'])
+
+    def test_track_feed_cache(self):
+        url = reverse('track-json-usermap', kwargs={'pk': self.usermap.pk})
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        b''.join(response.streaming_content)
+        # the second request is served from the cache
+        response = self.client.get(url)
+        self.assertFalse(response.streaming)
+        self.assertEqual(len(json.loads(response.content.decode())['features']), 3)
+        # a change to the map is a new version, once it is committed
+        with capture_on_commit_callbacks(execute=True):
+            self.usermap.tracks.remove(self.usermap.tracks.first())
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content).decode())
+        self.assertEqual(len(data['features']), 2)
+        # so is a change to a track on the map
+        track = self.usermap.tracks.first()
+        track.linestring = LineString((-114.38, 52.12), (-114.5, 52.5))
+        with capture_on_commit_callbacks(execute=True):
+            track.save()
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        b''.join(response.streaming_content)
+
+    def test_track_feed_cache_uncommitted_change(self):
+        url = reverse('track-json-usermap', kwargs={'pk': self.usermap.pk})
+        b''.join(self.client.get(url).streaming_content)
+        with capture_on_commit_callbacks() as callbacks:
+            self.usermap.tracks.remove(self.usermap.tracks.first())
+        # until the change is committed the map keeps its version, so whatever a request caches in the
+        # meantime stays under the old key
+        response = self.client.get(url)
+        self.assertFalse(response.streaming)
+        self.assertEqual(len(json.loads(response.content.decode())['features']), 3)
+        for callback in callbacks:
+            callback()
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content).decode())['features']), 2)
+
+    def test_simplified_track_feed(self):
+        # a track with a tiny wiggle at every vertex
+        track = TrackFeature.objects.create(
+            linestring=LineString([(-114 + i * 0.001, 52 + (i % 2) * 0.00001) for i in range(100)]),
+            owner=self.user1, timestamp_start=datetime.datetime(2018, 5, 11, tzinfo=datetime.timezone.utc))
+        self.assertLess(track.linestring_overview.num_points, 100)
+        self.usermap.tracks.set([track])
+        url = reverse('track-json-usermap', kwargs={'pk': self.usermap.pk})
+        response = self.client.get(url)
+        data = json.loads(b''.join(response.streaming_content).decode())
+        self.assertEqual(len(data['features'][0]['geometry']['coordinates']), 100)
+        response = self.client.get(url, {'zoom': 12})
+        data = json.loads(b''.join(response.streaming_content).decode())
+        self.assertEqual(len(data['features'][0]['geometry']['coordinates']), 2)
+
+    def test_note_clusters(self):
+        for i, (lon, lat) in enumerate([(-114.38, 52.12), (-114.3801, 52.1201), (-100.0, 45.0)]):
+            self.usermap.notes.add(Note.objects.create(
+                location=Point(lon, lat), lat=lat, lon=lon, altitude=1000, owner=self.user1, text=str(i),
+                timestamp=datetime.datetime(2018, 5, 10, 12, i, tzinfo=datetime.timezone.utc)))
+        url = reverse('note-cluster-usermap', kwargs={'pk': self.usermap.pk})
+        response = self.client.get(url, {'zoom': 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(response.content.decode())
+        self.assertEqual(sorted(f['properties']['count'] for f in data['features']), [1, 2])
+        self.assertEqual(sorted(f['properties']['text'] for f in data['features']), ['1', '2'])
+        response = self.client.get(url, {'zoom': 20})
+        self.assertEqual(len(json.loads(response.content.decode())['features']), 3)
+
+    def test_cluster_newest_by_timestamp(self):
+        # a note loaded later with an older timestamp is not the newest of its cluster
+        for i, minute in enumerate([30, 10]):
+            self.usermap.notes.add(Note.objects.create(
+                location=Point(-114.38, 52.12 + i * 0.0001), lat=52.12, lon=-114.38, altitude=1000, owner=self.user1,
+                text=str(minute), timestamp=datetime.datetime(2018, 5, 10, 12, minute, tzinfo=datetime.timezone.utc)))
+        url = reverse('note-cluster-usermap', kwargs={'pk': self.usermap.pk})
+        data = json.loads(self.client.get(url, {'zoom': 5}).content.decode())
+        self.assertEqual([f['properties']['text'] for f in data['features']], ['30'])
+
+    def test_private_map_feeds(self):
+        self.usermap.share_status = UserMap.PRIVATE
+        self.usermap.save()
+        self.client.force_login(self.user1)
+        names = ('track-json-usermap', 'image-json-usermap', 'note-cluster-usermap', 'image-cluster-usermap')
+        for name in names:
+            response = self.client.get(reverse(name, kwargs={'pk': self.usermap.pk}))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        # the documents the owner has cached are not served to anyone else
+        self.client.logout()
+        for name in names:
+            response = self.client.get(reverse(name, kwargs={'pk': self.usermap.pk}))
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_stream_in_blocks(self):
+        rows = [(i, '{"type": "Point", "coordinates": [1, 2]}', 'img_{0}.jpg'.format(i)) for i in range(100)]
+        with self.settings(GEOJSON_FEED_BLOCK_SIZE=1000):
+            blocks = list(stream_geojson(rows, ('webimg',)))
+        self.assertGreater(len(blocks), 1)
+        data = json.loads(''.join(blocks))
+        self.assertEqual(data['features'][99]['properties'], {'webimg': 'img_99.jpg', 'pk': '99'})
+
+
+class VectorTileTestCase(APITestCase):
+    def setUp(self):
+        self.user1 = UserFactory.build()
+        self.user1.save()
+        self.usermap = UserMap.objects.create(slug='test', description='test map', center=Point(-114.38, 52.12),
+                                              owner=self.user1, share_status=UserMap.PRIVATE)
+        track = TrackFeature.objects.create(
+            linestring=LineString((-114.38, 52.12), (-114.381, 52.123)), owner=self.user1,
+            timestamp_start=datetime.datetime(2018, 5, 10, 12, tzinfo=datetime.timezone.utc))
+        self.usermap.tracks.add(track)
+
+    def test_tile_envelope(self):
+        self.assertEqual(tile_envelope(0, 0, 0), (WORLD_ORIGIN, WORLD_ORIGIN, -WORLD_ORIGIN, -WORLD_ORIGIN))
+        xmin, ymin, xmax, ymax = tile_envelope(1, 1, 0)
+        self.assertEqual((xmin, ymin), (0, 0))
+        self.assertIsNone(tile_envelope(1, 2, 0))
+
+    def test_tile(self):
+        url = reverse('vector-tile', kwargs={'z': 0, 'x': 0, 'y': 0})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get(url, {'usermap': self.usermap.pk}).status_code,
+                         status.HTTP_403_FORBIDDEN)
+        self.client.force_login(self.user1)
+        response = self.client.get(url, {'usermap': self.usermap.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertIn(b'tracks', response.content)
+        response = self.client.get(reverse('vector-tile', kwargs={'z': 1, 'x': 2, 'y': 0}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,90 @@
+import math
+from django.conf import settings
+from django.db import connection
+from .models import TrackFeature, Note, ImageNote, UserMap
+
+
+# web mercator (EPSG:3857) bounds of the tile at zoom level 0
+WORLD_SIZE = 2 * math.pi * 6378137
+WORLD_ORIGIN = -WORLD_SIZE / 2
+MAX_ZOOM = 24
+
+# the tile coordinate extent and the buffer around the tile, in tile coordinates, passed to ST_AsMVTGeom
+MVT_EXTENT = 4096
+MVT_BUFFER = 64
+
+
+def tile_envelope(z, x, y):
+    """ the web mercator bounds of an XYZ tile
+    :return: (xmin, ymin, xmax, ymax) in EPSG:3857, or None if the tile does not exist
+    """
+    if not 0 <= z <= MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return None
+    size = WORLD_SIZE / 2 ** z
+    xmin = WORLD_ORIGIN + x * size
+    ymax = -WORLD_ORIGIN - y * size
+    return xmin, ymax - size, xmin + size, ymax
+
+
+# each layer: the model, the layer name, the geometry field and the attribute columns
+LAYERS = (
+    (TrackFeature, 'tracks', 'linestring', 'CAST(f.timestamp_start AS text) AS timestamp_start, '
+                                           'CAST(f.timestamp_end AS text) AS timestamp_end, f.text, f.lengthm'),
+    (Note, 'notes', 'location', 'CAST(f.timestamp AS text) AS timestamp, f.description, f.text'),
+    (ImageNote, 'images', 'location', 'CAST(f.timestamp AS text) AS timestamp, f.thumbnail, f.webimg'),
+)
+
+
+def layer_sql(model, name, field, columns, z, owner=None, usermap=None):
+    """ the sql and parameters for one ST_AsMVT layer of a tile; the tile bounds are the CTE 'bounds' """
+    column = 'f.' + model._meta.get_field(field).column
+    if name == 'tracks' and z <= settings.TRACK_OVERVIEW_ZOOM:
+        # tracks are drawn far smaller than their detail at overview zooms
+        geometry = 'COALESCE(f.linestring_overview, {0})'.format(column)
+    else:
+        geometry = column
+    where, params = [], []
+    if owner is not None:
+        where.append('f.owner_id = %s')
+        params.append(owner.pk)
+    if usermap is not None:
+        # the layers are named after the UserMap many to many fields
+        m2m = UserMap._meta.get_field(name)
+        where.append('f.id IN (SELECT {0} FROM {1} WHERE {2} = %s)'.format(
+            m2m.m2m_reverse_name(), m2m.m2m_db_table(), m2m.m2m_column_name()))
+        params.append(usermap.pk)
+    sql = ("SELECT COALESCE((SELECT ST_AsMVT(t, '{name}', {extent}, 'geom') FROM ("
+           "SELECT f.id, {columns}, "
+           "ST_AsMVTGeom(ST_Transform({geometry}, 3857), bounds.geom, {extent}, {buffer}, true) AS geom "
+           "FROM {table} f, bounds "
+           "WHERE {column} && bounds.search{where}) AS t "
+           # features that clip away to nothing inside the buffered tile are not encoded
+           "WHERE t.geom IS NOT NULL), ''::bytea)").format(
+        name=name, extent=MVT_EXTENT, buffer=MVT_BUFFER, columns=columns, geometry=geometry,
+        table=model._meta.db_table, column=column, where=''.join(' AND ' + w for w in where))
+    return sql, params
+
+
+def vector_tile(z, x, y, owner=None, usermap=None):
+    """ a Mapbox Vector Tile with the tracks, notes and images layers, encoded by PostGIS
+    :param owner: only features belonging to this user
+    :param usermap: only features linked to this UserMap
+    :return: the tile as bytes, or None if the tile does not exist
+    """
+    envelope = tile_envelope(z, x, y)
+    if envelope is None:
+        return None
+    # the tile bounds are expanded by the buffer so features crossing the tile edge are found
+    margin = (envelope[2] - envelope[0]) * MVT_BUFFER / MVT_EXTENT
+    layers, params = [], []
+    for model, name, field, columns in LAYERS:
+        sql, layer_params = layer_sql(model, name, field, columns, z, owner, usermap)
+        layers.append('({0})'.format(sql))
+        params.extend(layer_params)
+    # bounds.search is in the feature srid, so the spatial indexes can be used
+    sql = 'WITH bounds AS (SELECT ST_MakeEnvelope(%s, %s, %s, %s, 3857) AS geom, ' \
+          'ST_Transform(ST_Expand(ST_MakeEnvelope(%s, %s, %s, %s, 3857), %s), 4326) AS search) ' \
+          'SELECT {0}'.format(' || '.join(layers))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, list(envelope) + list(envelope) + [margin] + params)
+        return bytes(cursor.fetchone()[0])
@@ -18,6 +18,9 @@ urlpatterns = [
     # url(r'^track.geojson$', views.geojsonTrackFeed, name='track-json'),
     url(r'^track.geojson/(?P<pk>[0-9]+)$', views.geojsonTrackFeed, name='track-json-usermap'),
     url(r'^image.geojson/(?P<pk>[0-9]+)$', views.geojsonImageFeed, name='image-json-usermap'),
+    url(r'^imagecluster.geojson/(?P<pk>[0-9]+)$', views.geojsonImageClusterFeed, name='image-cluster-usermap'),
+    url(r'^notecluster.geojson/(?P<pk>[0-9]+)$', views.geojsonNoteClusterFeed, name='note-cluster-usermap'),
+    url(r'^tiles/(?P<z>[0-9]+)/(?P<x>[0-9]+)/(?P<y>[0-9]+)\.mvt$', views.vectorTile, name='vector-tile'),
     url(r'^imagenotes.geojson/$', views.ImageNoteList.as_view(), name='imagenote-gj-list'),
     url(r'^imagenotes.geojson/(?P<pk>[0-9]+)/$', views.ImageNoteDetail.as_view(), name='imagenote-gj-detail'),
 
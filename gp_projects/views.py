@@ -1,27 +1,143 @@
 from rest_framework import generics, permissions
+from rest_framework.exceptions import ParseError
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
-from .models import TrackFeature, ImageNote, Note, UserMap
+from .models import DailyActivity, TrackFeature, ImageNote, Note, UserMap, usermap_scope
 from .serializers import TrackFeatureSerializer, ImageNoteSerializer, NGImageNoteSerializer, \
     NGTrackFeatureSerializer, NGNoteSerializer
-from django.http import HttpResponse
-from django.db.models.functions import TruncDate
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.db.models import Sum
 from django.shortcuts import render, get_object_or_404
-from django.core.serializers import serialize
+from .feeds import cache_stream, cluster_rows, geojson_rows, stream_geojson, usermap_cache_key
+from .filters import spatial_temporal_filter
+from .pagination import KeysetPaginationMixin
+from .renderers import COMPACT_RENDERERS
+from .functions import request_tolerance, request_zoom, simplified_track
+from .tiles import vector_tile
 from django.views.generic import TemplateView, ListView
+from geotabloid.versioning import ConditionalGetMixin, conditional, owner_scope
+
+
+class OwnerConditionalGetMixin(ConditionalGetMixin):
+    """ conditional GET on the data of the request user """
+    def get_version_scopes(self):
+        return (owner_scope('gp_projects', self.request.user.pk),)
+
+
+def usermap_scopes(request, pk, **kwargs):
+    return (usermap_scope(pk),)
+
+
+def tile_scopes(request, **kwargs):
+    if 'usermap' in request.GET:
+        try:
+            return usermap_scopes(request, int(request.GET['usermap']))
+        except ValueError:
+            pass
+    return (owner_scope('gp_projects', request.user.pk),)
+
+
+def visible_usermap(request, pk):
+    """ the UserMap, unless it is private to someone other than the request user
+    the feeds check this before looking in the cache, the cached documents are shared by every user """
+    usermap = get_object_or_404(UserMap, pk=pk)
+    if usermap.share_status == UserMap.PRIVATE and request.user != usermap.owner:
+        raise PermissionDenied
+    return usermap
 
 
 # Geojson serializers
+# the features are encoded by PostGIS and streamed to the client as they are read from the database,
+# and the documents are cached until something on the map changes
+@conditional(usermap_scopes)
 def geojsonTrackFeed(request, pk):
     """ returns all of the TrackFeatures linked to a UserMap as geoJSON
+    the tracks are simplified to suit the map if a zoom= or tolerance= parameter is given
+    and filtered by the bbox=, near=/dist= and since=/until= parameters
      """
-    usermap = get_object_or_404(UserMap, pk=pk)
-    return HttpResponse(serialize('geojson', usermap.tracks.all(), fields=('timestamp_start', 'linestring')))
-
+    usermap = visible_usermap(request, pk)
+    key = usermap_cache_key(pk, 'tracks', request)
+    content = cache.get(key)
+    if content is not None:
+        return HttpResponse(content, content_type='application/json')
+    fields = ('timestamp_start',)
+    try:
+        tracks = spatial_temporal_filter(request.GET, usermap.tracks.all(), 'linestring', 'timestamp_start')
+    except ParseError as e:
+        return HttpResponseBadRequest(e.detail)
+    rows = geojson_rows(tracks, simplified_track(request_tolerance(request)), fields)
+    return StreamingHttpResponse(cache_stream(key, stream_geojson(rows, fields)), content_type='application/json')
+
+
+@conditional(usermap_scopes)
 def geojsonImageFeed(request, pk):
     """ returns all of the ImageNotes linked to a UserMap as geoJSON
+    filtered by the bbox=, near=/dist= and since=/until= parameters
      """
-    usermap = get_object_or_404(UserMap, pk=pk)
-    return HttpResponse(serialize('geojson', usermap.images.all(), fields=('webimg', 'location',)))
+    usermap = visible_usermap(request, pk)
+    key = usermap_cache_key(pk, 'images', request)
+    content = cache.get(key)
+    if content is not None:
+        return HttpResponse(content, content_type='application/json')
+    fields = ('webimg',)
+    try:
+        images = spatial_temporal_filter(request.GET, usermap.images.all(), 'location', 'timestamp')
+    except ParseError as e:
+        return HttpResponseBadRequest(e.detail)
+    rows = geojson_rows(images, 'location', fields)
+    return StreamingHttpResponse(cache_stream(key, stream_geojson(rows, fields)), content_type='application/json')
+
+
+def clusterFeed(request, pk, related, fields):
+    """ returns the point features of a UserMap as geoJSON clusters for the zoom= level, cached per zoom """
+    usermap = visible_usermap(request, pk)
+    key = usermap_cache_key(pk, related + '-clusters', request)
+    content = cache.get(key)
+    if content is None:
+        rows = cluster_rows(getattr(usermap, related).all(), request_zoom(request, usermap.zoom), fields)
+        content = ''.join(stream_geojson(rows, ('count',) + fields))
+        cache.set(key, content, settings.USERMAP_CACHE_TIMEOUT)
+    return HttpResponse(content, content_type='application/json')
+
+
+@conditional(usermap_scopes)
+def geojsonImageClusterFeed(request, pk):
+    """ returns the ImageNotes linked to a UserMap clustered for the zoom= level, with the count and
+    the images of the newest ImageNote of each cluster
+     """
+    return clusterFeed(request, pk, 'images', ('thumbnail', 'webimg'))
+
+
+@conditional(usermap_scopes)
+def geojsonNoteClusterFeed(request, pk):
+    """ returns the Notes linked to a UserMap clustered for the zoom= level, with the count and
+    the text of the newest Note of each cluster
+     """
+    return clusterFeed(request, pk, 'notes', ('description', 'text'))
+
+
+@conditional(tile_scopes)
+def vectorTile(request, z, x, y):
+    """ returns a Mapbox Vector Tile with tracks, notes and images layers
+    the features linked to the UserMap given by usermap=, otherwise the features of the current user
+    """
+    owner, usermap = None, None
+    if 'usermap' in request.GET:
+        try:
+            usermap = visible_usermap(request, int(request.GET['usermap']))
+        except ValueError:
+            raise Http404
+    elif request.user.is_authenticated:
+        owner = request.user
+    else:
+        raise PermissionDenied
+    tile = vector_tile(int(z), int(x), int(y), owner=owner, usermap=usermap)
+    if tile is None:
+        raise Http404
+    return HttpResponse(tile, content_type='application/vnd.mapbox-vector-tile')
 
 
 class TrackList(APIView):
@@ -31,48 +147,74 @@ class TrackList(APIView):
 
     def get_queryset(self):
         user = self.request.user
-        return TrackFeature.objects.filter(owner=user).defer('linestring')
+        return TrackFeature.objects.filter(owner=user).defer('linestring', 'linestring_overview')
 
 
-class TrackDetail(generics.RetrieveAPIView):
-    """ a restful detail view of a TrackFeature """
+class TrackDetail(ConditionalGetMixin, generics.RetrieveAPIView):
+    """ a restful detail view of a TrackFeature
+    the track is simplified to suit the map if a zoom= or tolerance= parameter is given
+    and may be sent in the compact formats, e.g. /tracks/1.polyline or ?format=geojson&precision=5 """
+    version_scopes = ('gp_projects',)
     queryset = TrackFeature.objects.all()
     serializer_class = TrackFeatureSerializer
+    renderer_classes = list(api_settings.DEFAULT_RENDERER_CLASSES) + COMPACT_RENDERERS
     permission_classes = (permissions.IsAuthenticated,)
 
+    def get_object(self):
+        tolerance = request_tolerance(self.request)
+        if tolerance is None:
+            return super().get_object()
+        self.queryset = TrackFeature.objects.defer('linestring', 'linestring_overview') \
+            .annotate(simplified=simplified_track(tolerance))
+        track = super().get_object()
+        track.linestring = track.simplified
+        return track
 
-class NGTrackFeatureList(generics.ListAPIView):
+
+class NGTrackFeatureList(OwnerConditionalGetMixin, KeysetPaginationMixin, generics.ListAPIView):
     """ a restful view of TrackFeatures by user, without the coordinates """
+    keyset_ordering = ('-timestamp_start', '-id')
     serializer_class = NGTrackFeatureSerializer
+    geometry_filter_field = 'linestring'
+    timestamp_filter_field = 'timestamp_start'
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_queryset(self):
         user = self.request.user
-        return TrackFeature.objects.filter(owner=user)
+        return TrackFeature.objects.filter(owner=user).defer('linestring', 'linestring_overview')
 
 
-class ImageNoteList(generics.ListAPIView):
+class ImageNoteList(ConditionalGetMixin, generics.ListAPIView):
     """ a restful view of ImageNotes by owner """
+    version_scopes = ('gp_projects',)
     queryset = ImageNote.objects.all()
     serializer_class = ImageNoteSerializer
+    renderer_classes = list(api_settings.DEFAULT_RENDERER_CLASSES) + COMPACT_RENDERERS
+    geometry_filter_field = 'location'
+    timestamp_filter_field = 'timestamp'
     # permission_classes = (permissions.IsAuthenticated,)
 
     # def get_queryset(self):
     #     user = self.request.user
     #     return ImageNote.objects.all()
 
-class ImageNoteDetail(generics.RetrieveAPIView):
+
+class ImageNoteDetail(OwnerConditionalGetMixin, generics.RetrieveAPIView):
     """ a restful detail view of an ImageNote """
     serializer_class = ImageNoteSerializer
+    renderer_classes = list(api_settings.DEFAULT_RENDERER_CLASSES) + COMPACT_RENDERERS
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_queryset(self):
         user = self.request.user
         return ImageNote.objects.filter(owner=user)
 
-class NGImageNoteList(generics.ListAPIView):
+
+class NGImageNoteList(OwnerConditionalGetMixin, KeysetPaginationMixin, generics.ListAPIView):
     """ a restful view of ImageNotes, without the coordinate data """
     serializer_class = NGImageNoteSerializer
+    geometry_filter_field = 'location'
+    timestamp_filter_field = 'timestamp'
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_queryset(self):
@@ -80,7 +222,7 @@ class NGImageNoteList(generics.ListAPIView):
         return ImageNote.objects.filter(owner=user)
 
 
-class NGImageNoteDetail(generics.RetrieveAPIView):
+class NGImageNoteDetail(OwnerConditionalGetMixin, generics.RetrieveAPIView):
     """ a restful detail view of an ImageNote, without the coordinate data """
     serializer_class = NGImageNoteSerializer
     permission_classes = (permissions.IsAuthenticated,)
@@ -90,17 +232,19 @@ class NGImageNoteDetail(generics.RetrieveAPIView):
         return ImageNote.objects.filter(owner=user)
 
 
-class NGNoteList(generics.ListAPIView):
+class NGNoteList(OwnerConditionalGetMixin, KeysetPaginationMixin, generics.ListAPIView):
     """ a restful view of Notes by owner, without the coordinate data """
     serializer_class = NGNoteSerializer
+    geometry_filter_field = 'location'
+    timestamp_filter_field = 'timestamp'
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_queryset(self):
         user = self.request.user
-        return Note.objects.filter(owner=user)
+        return Note.objects.filter(owner=user).prefetch_related('images')
 
 
-class NGNoteDetail(generics.RetrieveAPIView):
+class NGNoteDetail(OwnerConditionalGetMixin, generics.RetrieveAPIView):
     """ a restful detail view of a Note, without the coordinate data """
     serializer_class = NGNoteSerializer
     permission_classes = (permissions.IsAuthenticated,)
@@ -112,13 +256,12 @@ class NGNoteDetail(generics.RetrieveAPIView):
 
 def UserView(request):
     """a view of all the userdata owned by the requesting owner"""
-    date_list = Note.objects.annotate(date=TruncDate('timestamp')).distinct('date').values('date')
-    note_list = Note.objects.filter(owner=request.user)
-    image_list = ImageNote.objects.filter(owner=request.user)
-    track_list = TrackFeature.objects.filter(owner=request.user)
+    date_list = DailyActivity.objects.filter(owner=request.user)
+    totals = date_list.aggregate(notes=Sum('notes'), images=Sum('images'), tracks=Sum('tracks'))
+    image_list = ImageNote.objects.filter(owner=request.user).select_related('note')
     map_list = UserMap.objects.filter(owner=request.user)
-    context = {'date_list': date_list, 'note_list': note_list, 'image_list': image_list,
-               'track_list': track_list, 'map_list': map_list}
+    context = {'date_list': date_list, 'totals': {key: value or 0 for key, value in totals.items()},
+               'image_list': image_list, 'map_list': map_list}
     return render(request, 'userview.html', context=context)
 
 
@@ -127,6 +270,7 @@ class UserMapList(ListView):
     model = UserMap
     template_name = "usermaps.html"
 
+
 class UserMapView(TemplateView):
     """ a view to render a user map """
     template_name = "usermap.html"
@@ -1,20 +1,33 @@
 from django.contrib.gis import admin
 
 # Register your models here.
-from profiles.models import Project, UserProject, Tag, Basemap, Spatialitedbs, Otherfiles, Profile, ProfileSet
+from profiles.models import Project, UserProject, Tag, Basemap, Spatialitedbs, Otherfiles, Profile, ProfileSet, \
+    UserProjectUpload
 
 # a simple django admin page for a model
 admin.site.register(Project)
 
+
 # here is a more complex ModelAdmin example
 class UserProjectAdmin(admin.ModelAdmin):
     date_hierarchy = 'modifieddate'
     list_display = ('__str__', 'owner')
     list_filter = ('owner',)
     search_fields = ['document', 'description', 'owner__name', 'owner__email']
-    
+
+
 admin.site.register(UserProject, UserProjectAdmin)
 
+
+class UserProjectUploadAdmin(admin.ModelAdmin):
+    date_hierarchy = 'modifieddate'
+    list_display = ('filename', 'owner', 'offset', 'length', 'userproject')
+    list_filter = ('owner',)
+    readonly_fields = ['offset', 'chunks', 'userproject']
+
+
+admin.site.register(UserProjectUpload, UserProjectUploadAdmin)
+
 admin.site.register(Tag)
 admin.site.register(Basemap)
 admin.site.register(Spatialitedbs)
@@ -24,8 +37,10 @@ admin.site.register(Spatialitedbs)
 admin.site.register(Otherfiles, admin.OSMGeoAdmin)
 admin.site.register(Profile)
 
+
 class ProfileSetAdmin(admin.ModelAdmin):
     list_display = ('owner', 'public')
     list_filter = ('public',)
 
+
 admin.site.register(ProfileSet, ProfileSetAdmin)
@@ -0,0 +1,90 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from django.conf import settings
+
+try:
+    from prometheus_client import Counter, Histogram
+except ImportError:  # metrics export is optional, the stats are still logged and reported to celery
+    Counter = Histogram = None
+
+
+logger = logging.getLogger(__name__)
+
+if Histogram is not None:
+    PHASE_SECONDS = Histogram('geotabloid_ingest_phase_seconds', 'Time spent in each userproject ingest phase',
+                              ['phase'])
+    PHASE_ITEMS = Counter('geotabloid_ingest_items_total', 'Records handled in each userproject ingest phase',
+                          ['phase'])
+    PHASE_BYTES = Counter('geotabloid_ingest_bytes_total', 'Bytes handled in each userproject ingest phase',
+                          ['phase'])
+
+
+class IngestStats(object):
+    """ counts, byte totals and durations for each phase of one LoadUserProject run
+    Every finished phase is logged, reported as the PROGRESS state of the celery task (when there is one),
+    and - if prometheus_client is installed and settings.USERPROJECT_INGEST_METRICS is set - exported as
+    prometheus metrics, which the worker can serve with prometheus_client.start_http_server.
+
+        stats = IngestStats(task)
+        with stats.phase('tracks') as phase:
+            phase['count'] = import_tracks(...)
+
+    add() may be called from the image worker threads.
+    """
+    def __init__(self, task=None, name=''):
+        self.task = task
+        self.name = name
+        self.phases = OrderedDict()
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _get(self, name):
+        return self.phases.setdefault(name, {'count': 0, 'bytes': 0, 'seconds': 0.0})
+
+    @contextmanager
+    def phase(self, name):
+        """ time a block of work, the yielded dict takes its count and bytes
+        A phase may be timed more than once in a run, each block adds to the totals of the phase. """
+        block = {'count': 0, 'bytes': 0}
+        start = time.monotonic()
+        try:
+            yield block
+        finally:
+            self.add(name, count=block['count'], nbytes=block['bytes'], seconds=time.monotonic() - start)
+            self.report(name)
+
+    def add(self, name, count=0, nbytes=0, seconds=0.0):
+        """ add to the totals of a phase without timing it, e.g. one image out of many """
+        with self.lock:
+            stats = self._get(name)
+            stats['count'] += count
+            stats['bytes'] += nbytes
+            stats['seconds'] += seconds
+        if self.metrics_enabled():
+            PHASE_SECONDS.labels(name).observe(seconds)
+            PHASE_ITEMS.labels(name).inc(count)
+            PHASE_BYTES.labels(name).inc(nbytes)
+
+    def as_dict(self):
+        """ a JSON serializable summary, with rows per second for each phase """
+        with self.lock:
+            phases = OrderedDict()
+            for name, stats in self.phases.items():
+                phases[name] = dict(stats)
+                phases[name]['rate'] = stats['count'] / stats['seconds'] if stats['seconds'] else None
+        return {'userproject': self.name, 'seconds': time.monotonic() - self.started, 'phases': phases}
+
+    @staticmethod
+    def metrics_enabled():
+        return Histogram is not None and settings.USERPROJECT_INGEST_METRICS
+
+    def report(self, name):
+        """ log the totals of a phase and publish the progress; the metrics are observed by add() """
+        stats = self.phases[name]
+        logger.info('ingest %s %s: %d items, %d bytes in %.3fs', self.name, name, stats['count'], stats['bytes'],
+                    stats['seconds'])
+        if self.task is not None and self.task.request.id:
+            self.task.update_state(state='PROGRESS', meta=self.as_dict())
@@ -0,0 +1,35 @@
+# Generated by Django 2.0.8 on 2026-10-18 12:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('profiles', '0025_auto_20181026_1737'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserProjectUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('modifieddate', models.DateTimeField(auto_now_add=True)),
+                ('filename', models.CharField(max_length=255)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('length', models.BigIntegerField(verbose_name='Total size in bytes')),
+                ('offset', models.BigIntegerField(default=0, verbose_name='Bytes received')),
+                ('chunks', models.IntegerField(default=0, verbose_name='Chunks received')),
+                ('checksum', models.CharField(blank=True, default='', max_length=64, verbose_name='sha256 of the whole file')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('userproject', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='profiles.UserProject')),
+            ],
+            options={
+                'ordering': ('owner', '-modifieddate'),
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.8 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0026_userprojectupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userproject',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64, verbose_name='sha256 of the document'),
+        ),
+    ]
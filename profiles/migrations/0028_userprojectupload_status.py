@@ -0,0 +1,23 @@
+# Generated by Django 2.0.8 on 2026-10-19 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0027_userproject_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprojectupload',
+            name='status',
+            field=models.CharField(choices=[('receiving', 'receiving chunks'), ('assembling', 'assembling'), ('done', 'done'), ('failed', 'failed checksum')], default='receiving', max_length=10),
+        ),
+        # uploads assembled before the status was kept
+        migrations.RunSQL(
+            "UPDATE profiles_userprojectupload SET status = 'done' WHERE userproject_id IS NOT NULL;",
+            migrations.RunSQL.noop,
+        ),
+    ]
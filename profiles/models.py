@@ -1,11 +1,18 @@
+import hashlib
 import os
+import tempfile
+import uuid
 from django.contrib.gis.db import models
 from django.contrib.postgres.fields import ArrayField
 # from django.db import transaction
 from django.db.models import signals
 from django.dispatch import receiver
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.sites.models import Site
+from django.core.files import File
+from django.core.files.storage import default_storage
+from geotabloid.versioning import bump, bump_once, bumping_once
 from .tasks import LoadUserProject
 
 
@@ -56,6 +63,14 @@ def project_post_delete(sender, instance, **kwargs):
     instance.url.delete(False)
 
 
+def file_sha256(content):
+    """ the sha256 hex digest of a File, read a chunk at a time """
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
 def userproject_directory_path(instance, filename):
     # file will be uploaded to MEDIA_ROOT/<owner>/userprojects/<filename>
     return '{0}/userprojects/{1}'.format(instance.owner, os.path.basename(filename))
@@ -68,6 +83,28 @@ class UserProject(models.Model):
     owner = models.ForeignKey('users.user', to_field='id', on_delete=models.CASCADE, blank=True, null=True)
     document = models.FileField(upload_to=userproject_directory_path)
     description = models.TextField(blank=True, null=True)
+    sha256 = models.CharField(max_length=64, blank=True, default='', db_index=True,
+                              verbose_name="sha256 of the document")
+
+    def save(self, *args, **kwargs):
+        """
+        hash a newly uploaded document before it is stored
+        """
+        if not self.sha256 and self.document and not self.document._committed:
+            self.sha256 = file_sha256(self.document)
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def find_duplicate(cls, owner, sha256):
+        """
+        return the owner's existing UserProject with the same content, if there is one.
+        An identical re-upload is not stored or loaded again, instead the existing copy is kept
+        for another retention period.
+        """
+        duplicate = cls.objects.filter(owner=owner, sha256=sha256).first()
+        if duplicate is not None:
+            cls.objects.filter(pk=duplicate.pk).update(modifieddate=timezone.now())
+        return duplicate
 
     def __str__(self):
         return self.document.name
@@ -78,17 +115,20 @@ class UserProject(models.Model):
 
 # Add a post save process for userprojects to unpack the data after upload
 @receiver(signals.post_save, sender=UserProject)
-def userproject_post_save(sender, instance, signal, *args, **kwargs):
+def userproject_post_save(sender, instance, signal, created=False, *args, **kwargs):
     """
     When a userproject has been uploaded, call the LoadUserProject method as an asynchronous celery task
     Loads the notes, images, and tracks into the gp_projects table
+    Later saves of the same record (e.g. editing the description) do not load the project again.
     :param sender: UserProject class
     :param instance: the uploaded instance
     :param signal: post_save
+    :param created: True if this is a new record
     :param args:
     :param kwargs:
     """
-    LoadUserProject.delay(instance.document.name, instance.owner.id)
+    if created:
+        LoadUserProject.delay(instance.document.name, instance.owner.id)
 
 
 # register the post save process as a signal ref:  https://docs.djangoproject.com/en/2.1/topics/signals/
@@ -105,6 +145,113 @@ def userproject_post_delete(sender, instance, **kwargs):
     instance.document.delete(False)
 
 
+def upload_chunk_path(upload, index):
+    # chunks are stored as MEDIA_ROOT/<owner>/uploads/<upload id>/<index>
+    return '{0}/uploads/{1}/{2:06d}'.format(upload.owner, upload.pk, index)
+
+
+class UserProjectUpload(models.Model):
+    """ A resumable, chunked upload of a userproject.
+    The client declares the total length (and optionally the sha256 of the whole file) up front, then sends
+    the file in chunks, each starting at the current offset.  The chunks are kept in storage until the last
+    one arrives, then they are assembled into a UserProject by the AssembleUserProjectUpload task - which
+    starts LoadUserProject.  The client polls the status of the upload until it is done or failed.
+    """
+    RECEIVING = 'receiving'
+    ASSEMBLING = 'assembling'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS = (
+        (RECEIVING, 'receiving chunks'),
+        (ASSEMBLING, 'assembling'),
+        (DONE, 'done'),
+        (FAILED, 'failed checksum'),
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    modifieddate = models.DateTimeField(auto_now_add=True)
+    owner = models.ForeignKey('users.user', to_field='id', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    description = models.TextField(blank=True, null=True)
+    length = models.BigIntegerField(verbose_name="Total size in bytes")
+    offset = models.BigIntegerField(default=0, verbose_name="Bytes received")
+    chunks = models.IntegerField(default=0, verbose_name="Chunks received")
+    checksum = models.CharField(max_length=64, blank=True, default='', verbose_name="sha256 of the whole file")
+    userproject = models.ForeignKey(UserProject, on_delete=models.SET_NULL, blank=True, null=True)
+    status = models.CharField(max_length=10, choices=STATUS, default=RECEIVING)
+
+    def chunk_names(self):
+        return [upload_chunk_path(self, index) for index in range(self.chunks)]
+
+    def save_chunk(self, content):
+        """ store the next chunk of the upload and advance the offset, the upload is ready to assemble
+        once the last chunk is stored
+        :param content: a File holding the chunk
+        """
+        name = upload_chunk_path(self, self.chunks)
+        # a chunk left over from an attempt that was never committed must not push this one to a new name
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        default_storage.save(name, content)
+        self.offset += content.size
+        self.chunks += 1
+        if self.complete():
+            self.status = self.ASSEMBLING
+        self.save()
+
+    def assemble(self):
+        """ join the chunks of a finished upload into a new UserProject, which starts LoadUserProject
+        The chunks are streamed through a local temporary file and checked against the declared checksum.
+        If the owner already has a UserProject with the same content, that one is returned instead.
+        The chunks are removed either way, and the status of the upload is set to done or failed.
+        :rtype: UserProject, or None if the assembled file does not match the checksum
+        """
+        digest = hashlib.sha256()
+        with tempfile.TemporaryFile() as assembled:
+            for name in self.chunk_names():
+                with default_storage.open(name, 'rb') as chunk:
+                    for block in chunk.chunks():
+                        digest.update(block)
+                        assembled.write(block)
+            if self.checksum and digest.hexdigest() != self.checksum.lower():
+                userproject = None
+            else:
+                userproject = self.find_or_create_userproject(digest.hexdigest(), assembled)
+        for name in self.chunk_names():
+            default_storage.delete(name)
+        self.userproject = userproject
+        self.status = self.FAILED if userproject is None else self.DONE
+        self.save()
+        return userproject
+
+    def find_or_create_userproject(self, sha256, assembled):
+        """ the owner's UserProject with this content, or a new one stored from the assembled file """
+        userproject = UserProject.find_duplicate(self.owner, sha256)
+        if userproject is None:
+            assembled.seek(0)
+            userproject = UserProject(owner=self.owner, description=self.description, sha256=sha256)
+            userproject.document.save(self.filename, File(assembled), save=True)
+        return userproject
+
+    def complete(self):
+        return self.offset >= self.length
+
+    def __str__(self):
+        return '{0} {1}/{2}'.format(self.filename, self.offset, self.length)
+
+    class Meta:
+        ordering = ('owner', '-modifieddate',)
+
+
+@receiver(signals.post_delete, sender=UserProjectUpload)
+def userprojectupload_post_delete(sender, instance, **kwargs):
+    """
+    Deletes any chunks left in storage
+    when corresponding `UserProjectUpload` object is deleted.
+    """
+    for name in instance.chunk_names():
+        default_storage.delete(name)
+
+
 def tag_directory_path(instance, filename):
     # file will be uploaded to MEDIA_ROOT/<owner>/tags/<filename>
     return '{0}/tags/{1}'.format(instance.owner, os.path.basename(filename))
@@ -277,3 +424,96 @@ class ProfileSet(models.Model):
 
     class Meta:
         ordering = ('owner',)
+
+
+def profileset_scope(profileset_id):
+    """ the scope of the manifest of one ProfileSet """
+    return 'profiles:profileset:{0}'.format(profileset_id)
+
+
+# the lookup from ProfileSet to each model its manifest includes
+PROFILESET_LOOKUPS = {
+    Profile: 'profiles',
+    Project: 'profiles__project',
+    Tag: 'profiles__tags',
+    Basemap: 'profiles__basemaps',
+    Spatialitedbs: 'profiles__spatialitedbs',
+    Otherfiles: 'profiles__otherfiles',
+}
+
+
+def profilesets_including(sender, instance):
+    """ the ids of the ProfileSets whose manifest includes the instance """
+    if sender is ProfileSet:
+        return [instance.pk]
+    return list(ProfileSet.objects.filter(**{PROFILESET_LOOKUPS[sender]: instance})
+                .values_list('pk', flat=True).distinct())
+
+
+def bump_profilesets(profileset_ids):
+    """ record a change to the profiles, and to the manifests of some ProfileSets, for conditional GET """
+    bump('profiles', *[profileset_scope(pk) for pk in profileset_ids])
+
+
+def delete_profile_items(queryset):
+    """ delete ProfileSets, Profiles or the projects, tags and files of profiles in bulk.  The ProfileSets including
+    them are found in one query and bumped once, instead of for every row. """
+    if queryset.model is ProfileSet:
+        profileset_ids = queryset.values_list('pk', flat=True)
+    else:
+        lookup = PROFILESET_LOOKUPS[queryset.model] + '__in'
+        profileset_ids = ProfileSet.objects.filter(**{lookup: queryset.values('pk')}).values_list('pk', flat=True) \
+            .distinct()
+    with bump_once('profiles', *[profileset_scope(pk) for pk in profileset_ids]):
+        return queryset.delete()
+
+
+@receiver(signals.pre_delete, sender=Project)
+@receiver(signals.pre_delete, sender=Tag)
+@receiver(signals.pre_delete, sender=Basemap)
+@receiver(signals.pre_delete, sender=Spatialitedbs)
+@receiver(signals.pre_delete, sender=Otherfiles)
+@receiver(signals.pre_delete, sender=Profile)
+def profiles_pre_delete(sender, instance, **kwargs):
+    # the links from the profiles are gone by post_delete; delete_profile_items has already found the sets
+    if not bumping_once():
+        instance._profileset_ids = profilesets_including(sender, instance)
+
+
+@receiver([signals.post_save, signals.post_delete], sender=Project)
+@receiver([signals.post_save, signals.post_delete], sender=Tag)
+@receiver([signals.post_save, signals.post_delete], sender=Basemap)
+@receiver([signals.post_save, signals.post_delete], sender=Spatialitedbs)
+@receiver([signals.post_save, signals.post_delete], sender=Otherfiles)
+@receiver([signals.post_save, signals.post_delete], sender=Profile)
+@receiver([signals.post_save, signals.post_delete], sender=ProfileSet)
+def profiles_changed(sender, instance, **kwargs):
+    profileset_ids = instance.__dict__.pop('_profileset_ids', None)
+    if profileset_ids is None:
+        profileset_ids = [] if bumping_once() else profilesets_including(sender, instance)
+    bump_profilesets(profileset_ids)
+
+
+@receiver(signals.m2m_changed, sender=Profile.basemaps.through)
+@receiver(signals.m2m_changed, sender=Profile.spatialitedbs.through)
+@receiver(signals.m2m_changed, sender=Profile.otherfiles.through)
+def profile_files_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # a file is about to be removed from all of its profiles
+        instance._profileset_ids = profilesets_including(type(instance), instance)
+    elif reverse and action == 'post_clear':
+        bump_profilesets(instance.__dict__.pop('_profileset_ids'))
+    elif action.startswith('post_'):
+        profile_ids = pk_set if reverse else [instance.pk]
+        bump_profilesets(ProfileSet.objects.filter(profiles__in=profile_ids).values_list('pk', flat=True).distinct())
+
+
+@receiver(signals.m2m_changed, sender=ProfileSet.profiles.through)
+def profileset_profiles_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # a profile is about to be removed from all of its sets
+        instance._profileset_ids = profilesets_including(Profile, instance)
+    elif reverse and action == 'post_clear':
+        bump_profilesets(instance.__dict__.pop('_profileset_ids'))
+    elif action.startswith('post_'):
+        bump_profilesets(pk_set if reverse else [instance.pk])
@@ -1,10 +1,11 @@
 from collections import OrderedDict
 from rest_framework import serializers
 from profiles.models import Project, Tag, Basemap, Spatialitedbs, Otherfiles, Profile, ProfileSet
-from profiles.models import UserProject
+from profiles.models import UserProject, UserProjectUpload
 from django.contrib.auth import get_user_model
 from rest_framework.fields import SkipField
 
+
 class ProjectSerializer(serializers.ModelSerializer):
     class Meta:
         model = Project
@@ -16,13 +17,36 @@ class ProjectSerializer(serializers.ModelSerializer):
         result = super(ProjectSerializer, self).to_representation(instance)
         return OrderedDict([(key, result[key]) for key in result if result[key] is not None])
 
+
 class UserProjectSerializer(serializers.HyperlinkedModelSerializer):
     owner = serializers.SlugRelatedField(read_only=True, slug_field='id')
-    
+
     class Meta:
         model = UserProject
-        fields = ('modifieddate', 'owner', 'document', 'description')
-        
+        fields = ('modifieddate', 'owner', 'document', 'description', 'sha256')
+        read_only_fields = ('sha256',)
+
+
+class UserProjectUploadSerializer(serializers.ModelSerializer):
+    owner = serializers.SlugRelatedField(read_only=True, slug_field='id')
+
+    class Meta:
+        model = UserProjectUpload
+        fields = ('id', 'modifieddate', 'owner', 'filename', 'description', 'length', 'offset', 'checksum',
+                  'userproject', 'status')
+        read_only_fields = ('offset', 'userproject', 'status')
+
+    def validate_length(self, value):
+        if value <= 0:
+            raise serializers.ValidationError('length must be greater than zero')
+        return value
+
+    def validate_checksum(self, value):
+        if value and (len(value) != 64 or any(c not in '0123456789abcdef' for c in value.lower())):
+            raise serializers.ValidationError('checksum must be a hex encoded sha256 digest')
+        return value.lower()
+
+
 class TagSerializer(serializers.ModelSerializer):
     owner = serializers.SlugRelatedField(read_only=True, slug_field='id')
 
@@ -35,6 +59,7 @@ class TagSerializer(serializers.ModelSerializer):
         result = super(TagSerializer, self).to_representation(instance)
         return OrderedDict([(key, result[key]) for key in result if result[key] is not None])
 
+
 class BasemapSerializer(serializers.ModelSerializer):
     class Meta:
         model = Basemap
@@ -45,6 +70,7 @@ class BasemapSerializer(serializers.ModelSerializer):
         result = super(BasemapSerializer, self).to_representation(instance)
         return OrderedDict([(key, result[key]) for key in result if result[key] is not None])
 
+
 class SpatialitedbsSerializer(serializers.ModelSerializer):
     class Meta:
         model = Spatialitedbs
@@ -55,6 +81,7 @@ class SpatialitedbsSerializer(serializers.ModelSerializer):
         result = super(SpatialitedbsSerializer, self).to_representation(instance)
         return OrderedDict([(key, result[key]) for key in result if result[key] is not None])
 
+
 class OtherfilesSerializer(serializers.ModelSerializer):
     class Meta:
         model = Otherfiles
@@ -65,6 +92,7 @@ class OtherfilesSerializer(serializers.ModelSerializer):
         result = super(OtherfilesSerializer, self).to_representation(instance)
         return OrderedDict([(key, result[key]) for key in result if result[key] is not None])
 
+
 class ProfileSerializer(serializers.ModelSerializer):
     project = ProjectSerializer(read_only=True)
     tags = TagSerializer(read_only=True)
@@ -82,6 +110,7 @@ class ProfileSerializer(serializers.ModelSerializer):
         fields = ('name', 'description', 'creationdate', 'modifieddate', 'color', 'active',
                   'sdcardPath', 'mapView', 'project', 'tags', 'basemaps', 'spatialitedbs', 'otherfiles' )
 
+
 class ProfileSetSerializer(serializers.ModelSerializer):
     profiles = ProfileSerializer(read_only=True, many=True)
     class Meta:
@@ -0,0 +1,66 @@
+"""
+Summary statistics for the profiles Catalog page
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from geotabloid.versioning import get_stamp
+from .models import Project, Tag, Basemap, Spatialitedbs, Otherfiles, Profile, ProfileSet, UserProject
+
+
+# the counts and the models they are taken from
+COUNTED = (
+    ('num_projects', Project),
+    ('num_otherfiles', Otherfiles),
+    ('num_tags', Tag),
+    ('num_spatialitedbs', Spatialitedbs),
+    ('num_basemaps', Basemap),
+    ('num_profiles', Profile),
+    ('num_userprojects', UserProject),
+    ('num_profilesets', ProfileSet),
+)
+# the latest modification of the files handed out with the profiles, and of the user data
+RECORD_MODELS = (Project, Otherfiles, Tag, Spatialitedbs, Basemap)
+USER_MODELS = (Profile, UserProject)
+
+
+def count_sql(model):
+    """ an exact count, unless the planner statistics say the table has more than
+    settings.CATALOG_STATS_EXACT_LIMIT rows, when the estimate is close enough and costs nothing """
+    table = connection.ops.quote_name(model._meta.db_table)
+    return ('(SELECT CASE WHEN c.reltuples > %s THEN c.reltuples::bigint '
+            'ELSE (SELECT count(*) FROM {0}) END FROM pg_class c WHERE c.oid = \'{0}\'::regclass)').format(table)
+
+
+def latest_sql(models):
+    """ the latest modifieddate of the models; GREATEST ignores the empty tables """
+    return 'GREATEST({0})'.format(', '.join('(SELECT max(modifieddate) FROM {0})'.format(
+        connection.ops.quote_name(model._meta.db_table)) for model in models))
+
+
+def query_catalog_stats():
+    """ all of the catalog statistics in one query """
+    user_table = connection.ops.quote_name(get_user_model()._meta.db_table)
+    columns = [count_sql(model) for name, model in COUNTED] + [
+        '(SELECT count(*) FROM {0})'.format(user_table),
+        '(SELECT count(*) FROM {0} WHERE is_superuser)'.format(user_table),
+        latest_sql(RECORD_MODELS),
+        latest_sql(USER_MODELS),
+    ]
+    names = [name for name, model in COUNTED] + ['num_users', 'num_superusers', 'last_rcd', 'last_usr']
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT ' + ', '.join(columns), [settings.CATALOG_STATS_EXACT_LIMIT] * len(COUNTED))
+        return dict(zip(names, cursor.fetchone()))
+
+
+def catalog_stats():
+    """ the catalog statistics, cached for settings.CATALOG_STATS_TIMEOUT seconds or until the profiles change
+    :rtype: dict of the counts, and the latest dates (None for empty tables)
+    """
+    key = 'catalog:stats:{0}'.format(get_stamp('profiles'))
+    stats = cache.get(key)
+    if stats is None:
+        stats = query_catalog_stats()
+        cache.set(key, stats, settings.CATALOG_STATS_TIMEOUT)
+    return stats
@@ -1,29 +1,541 @@
 # Create your tasks here
 from __future__ import absolute_import, unicode_literals
+import io
+import logging
 import os
+import shutil
+import struct
+import sys
+import time
+from array import array
+from itertools import chain
 from datetime import datetime, timezone, timedelta
 # from celery import shared_task
 from geotabloid.taskapp.celery import app
 import sqlite3
 import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image, ExifTags
+from django.conf import settings
 from django.db import IntegrityError, transaction
 from django.contrib.auth import get_user_model
-from gp_projects.models import ImageNote, Note, TrackFeature
-from django.contrib.gis.geos import Point, LineString
-from django.core.files import File
+from gp_projects.models import DailyActivity, ImageNote, IngestWatermark, Note, TrackFeature, bump_owner
+from django.contrib.gis.geos import GEOSGeometry, Point
+from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
+from profiles.instrumentation import IngestStats
 
 
-@app.task
-def LoadUserProject(userproject_file, ownerid):
+logger = logging.getLogger(__name__)
+
+
+class ScratchSpace(object):
+    """ a private working directory for one ingest
+    Files are placed on tmpfs while they fit within settings.USERPROJECT_SCRATCH_TMPFS_BUDGET (and the free
+    space on it), anything larger goes to a directory under settings.USERPROJECT_SCRATCH_DIR.  Each task gets
+    its own directories, so concurrent ingests can't clobber each other's files, and both are removed with
+    everything in them when the context exits.
+
+        with ScratchSpace() as scratch:
+            with open(scratch.path('userproject.gpap', size), 'wb') as f:
+                ...
+    """
+    def __init__(self, tmpfs=None, budget=None, root=None):
+        self.tmpfs = settings.USERPROJECT_SCRATCH_TMPFS if tmpfs is None else tmpfs
+        self.budget = settings.USERPROJECT_SCRATCH_TMPFS_BUDGET if budget is None else budget
+        self.root = root or settings.USERPROJECT_SCRATCH_DIR
+        self.used = 0
+        self.dirs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+        return False
+
+    def cleanup(self):
+        for directory in self.dirs.values():
+            shutil.rmtree(directory, ignore_errors=True)
+        self.dirs = {}
+        self.used = 0
+
+    def _dir(self, parent):
+        if parent not in self.dirs:
+            self.dirs[parent] = tempfile.mkdtemp(prefix='userproject-', dir=parent)
+        return self.dirs[parent]
+
+    def _fits_tmpfs(self, size):
+        if not self.tmpfs or not os.access(self.tmpfs, os.W_OK) or self.used + size > self.budget:
+            return False
+        return size < shutil.disk_usage(self.tmpfs).free
+
+    def path(self, name, size=0):
+        """ a path in the workspace for a file of (about) size bytes
+        :param name: the file name, any directory part is dropped
+        :param size: expected size of the file, used to decide if it can go on tmpfs
+        :rtype: string
+        """
+        if self._fits_tmpfs(size):
+            self.used += size
+            parent = self.tmpfs
+        else:
+            parent = self.root
+        return os.path.join(self._dir(parent), os.path.basename(name))
+
+
+def copy_to_local(name, destination, chunk_size=None):
+    """ stream a file from the default storage into a local file, one chunk at a time
+    :param name: storage name of the file to be copied
+    :param destination: a local file object opened for binary writing
+    :param chunk_size: the largest block held in memory, defaults to settings.USERPROJECT_COPY_CHUNK_SIZE
+    :rtype: int, the number of bytes copied
+    """
+    chunk_size = chunk_size or settings.USERPROJECT_COPY_CHUNK_SIZE
+    copied = 0
+    with default_storage.open(name, 'rb') as document:
+        for chunk in document.chunks(chunk_size=chunk_size):
+            destination.write(chunk)
+            copied += len(chunk)
+    destination.flush()
+    return copied
+
+
+def ms_to_datetime(ts):
+    """ convert a geopaparazzi timestamp (milliseconds since the epoch) to an aware UTC datetime """
+    return datetime.utcfromtimestamp(ts/1000).replace(tzinfo=timezone.utc)
+
+
+# WKB header for a LineString in the native byte order: byte order flag, geometry type, number of points
+WKB_LINESTRING_HEADER = struct.Struct('=BII')
+WKB_BYTE_ORDER = 1 if sys.byteorder == 'little' else 0
+WKB_LINESTRING = 2
+
+
+def gpslog_linestring(conn, logid):
+    """ build the LineString for a gpslog straight from its rows in the sqlite database
+    The coordinates are packed into a flat array of doubles and handed to GEOS as WKB,
+    so no Point (or any other per-vertex geometry) is created.
+    :param conn: sqlite3 connection to the userproject
+    :param logid: _id of the gpslogs record
+    :rtype: GEOSGeometry, or None if the log has fewer than two points
+    """
+    rows = conn.execute('SELECT lon, lat FROM gpslogsdata WHERE logid=? ORDER BY ts ASC', (logid,))
+    coords = array('d', chain.from_iterable(rows))
+    npoints = len(coords) // 2
+    if npoints < 2:
+        return None
+    wkb = WKB_LINESTRING_HEADER.pack(WKB_BYTE_ORDER, WKB_LINESTRING, npoints) + coords.tobytes()
+    return GEOSGeometry(memoryview(wkb))
+
+
+def bulk_save(model, records, batch_size):
+    """ insert a list of new records with bulk_create
+    If the batch collides with rows inserted since the duplicates were checked (e.g. a concurrent upload),
+    fall back to saving the records one at a time and skipping the duplicates.
+    :rtype: list of the records that were saved
+    """
+    try:
+        with transaction.atomic():
+            return model.objects.bulk_create(records, batch_size=batch_size)
+    except IntegrityError:
+        saved = []
+        for rcd in records:
+            try:
+                with transaction.atomic():
+                    rcd.save()
+                saved.append(rcd)
+            except IntegrityError:  # if the record is already in the database, catch the error and continue
+                pass
+        return saved
+
+
+def import_tracks(conn, owner, batch_size=None, since=0):
+    """ import the gpslogs of a userproject as TrackFeatures
+    Tracks already loaded for the owner are found with a single query on the (timestamp_start, owner) key
+    and skipped, the rest are inserted in batches.
+    :param conn: sqlite3 connection to the userproject
+    :param owner: the User that owns the tracks
+    :param batch_size: number of tracks per insert, defaults to settings.USERPROJECT_TRACK_BATCH_SIZE
+    :param since: only gpslogs that started after this geopaparazzi timestamp are read
+    :rtype: int, the number of tracks imported
+    """
+    batch_size = batch_size or settings.USERPROJECT_TRACK_BATCH_SIZE
+    gpslogs = [dict(gpslog) for gpslog in conn.execute('SELECT * FROM gpslogs WHERE startts > ? ORDER BY startts ASC;',
+                                                       (since,))]
+    if not gpslogs:
+        return 0
+
+    start = ms_to_datetime(gpslogs[0]['startts'])
+    end = ms_to_datetime(gpslogs[-1]['startts'])
+    known = set(TrackFeature.objects.filter(owner=owner, timestamp_start__range=(start, end))
+                .values_list('timestamp_start', flat=True))
+
+    imported = 0
+    batch = []
+    for log_dict in gpslogs:
+        timestamp_start = ms_to_datetime(log_dict['startts'])
+        if timestamp_start in known:  # the track is already in the database
+            continue
+        known.add(timestamp_start)
+        linestring = gpslog_linestring(conn, log_dict['_id'])
+        if linestring is None:
+            logger.warning("Skipping track at %s - not enough points", timestamp_start)
+            continue
+        track = TrackFeature(owner=owner, text=log_dict['text'], linestring=linestring,
+                             timestamp_start=timestamp_start,
+                             timestamp_end=ms_to_datetime(log_dict['endts']),
+                             lengthm=log_dict['lengthm'])
+        track.update_geometry_fields()
+        batch.append(track)
+        if len(batch) >= batch_size:
+            imported += len(bulk_save(TrackFeature, batch, batch_size))
+            batch = []
+    if batch:
+        imported += len(bulk_save(TrackFeature, batch, batch_size))
+    return imported
+
+
+def import_notes(conn, owner, batch_size=None, since=0):
+    """ import the notes of a userproject
+    The owner's existing (timestamp, owner) keys are fetched with one query, known notes are skipped
+    and the rest are inserted in batches.
+    :param conn: sqlite3 connection to the userproject
+    :param owner: the User that owns the notes
+    :param batch_size: number of notes per insert, defaults to settings.USERPROJECT_NOTE_BATCH_SIZE
+    :param since: only notes newer than this geopaparazzi timestamp are read
+    :rtype: dict mapping the sqlite notes._id to the Note id, for both new and previously loaded notes
+    """
+    batch_size = batch_size or settings.USERPROJECT_NOTE_BATCH_SIZE
+    notes = [dict(nt) for nt in conn.execute('SELECT * FROM notes WHERE ts > ? ORDER BY ts ASC;', (since,))]
+    if not notes:
+        return {}
+
+    start = ms_to_datetime(notes[0]['ts'])
+    end = ms_to_datetime(notes[-1]['ts'])
+    known = dict(Note.objects.filter(owner=owner, timestamp__range=(start, end)).values_list('timestamp', 'id'))
+
+    note_ids = {}
+    pending = {}  # timestamp -> sqlite _id of the notes waiting to be inserted
+    batch = []
+
+    def flush():
+        for rcd in bulk_save(Note, batch, batch_size):
+            known[rcd.timestamp] = rcd.id
+
+    for nt_dict in notes:
+        ts = ms_to_datetime(nt_dict['ts'])
+        if ts in known:
+            note_ids[nt_dict['_id']] = known[ts]
+            continue
+        if ts in pending:  # a second note with the same timestamp cannot be stored
+            continue
+        pending[ts] = nt_dict['_id']
+        batch.append(Note(owner=owner, text=nt_dict['text'], form=nt_dict['form'], timestamp=ts,
+                          description=nt_dict['description'], lat=nt_dict['lat'], lon=nt_dict['lon'],
+                          location=Point(nt_dict['lon'], nt_dict['lat']), altitude=nt_dict['altim']))
+        if len(batch) >= batch_size:
+            flush()
+            batch = []
+    if batch:
+        flush()
+
+    # notes that lost a race with a concurrent upload were not saved here, but they are in the database now
+    missing = [ts for ts in pending if ts not in known]
+    if missing:
+        known.update(Note.objects.filter(owner=owner, timestamp__in=missing).values_list('timestamp', 'id'))
+    for ts, nt_id in pending.items():
+        if ts in known:
+            note_ids[nt_id] = known[ts]
+    return note_ids
+
+
+# the Image.transpose operations that undo each EXIF orientation, as in ImageOps.exif_transpose
+# the size of the thumbnails made by geopaparazzi, used when a project has an image without one
+GPAP_THUMBNAIL_SIZE = 100
+ORIENTATION_TAG = next(tag for tag, name in ExifTags.TAGS.items() if name == 'Orientation')
+EXIF_TRANSPOSE = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+
+
+def image_orientation(image):
+    """ the EXIF orientation of an opened (not yet decoded) image, 1 if it has none """
+    try:
+        return image._getexif()[ORIENTATION_TAG]
+    except (AttributeError, KeyError, IndexError, TypeError):
+        # cases: image don't have getexif, or it has no orientation tag
+        return 1
+
+
+def downscale(image, size):
+    """ shrink an image to fit within size, keeping the aspect ratio
+    Large reductions are done in two steps - a cheap box filter down to twice the target size,
+    then a Lanczos filter for the final size - which is much faster than filtering the full image.
+    :rtype: Image
+    """
+    scale = min(size[0] / image.width, size[1] / image.height)
+    if scale >= 1:
+        return image
+    target = max(1, round(image.width * scale)), max(1, round(image.height * scale))
+    if scale < 0.5:
+        image = image.resize((target[0] * 2, target[1] * 2), Image.BOX)
+    return image.resize(target, Image.LANCZOS)
+
+
+def encode_image(image, fmt, **options):
+    """ encode an image to bytes in the given format """
+    if fmt == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    output = io.BytesIO()
+    image.save(output, fmt, **options)
+    return output.getvalue()
+
+
+def render_image(blob, websize=None, thumbsize=None):
+    """ produce the stored image, the web image and optionally a thumbnail from an image blob,
+    decoding it only once and without touching the disk.
+    An image without an EXIF orientation is stored exactly as it was uploaded, so it only needs to be
+    decoded at a reduced size (JPEG draft mode) for the derived images.  A rotated image is decoded once
+    at full size, transposed upright and re-encoded, and the derived images are scaled from that buffer.
+    :param blob: the image file contents
+    :param websize: bounding box of the web image, defaults to settings.USERPROJECT_WEBIMG_SIZE
+    :param thumbsize: bounding box of the thumbnail, no thumbnail is made if this is None
+    :rtype: tuple of bytes (image, webimg, thumbnail) - thumbnail is None if no thumbsize was given
+    """
+    websize = websize or (settings.USERPROJECT_WEBIMG_SIZE, settings.USERPROJECT_WEBIMG_SIZE)
+    image = Image.open(io.BytesIO(blob))
+    fmt = image.format or 'JPEG'
+    transpose = EXIF_TRANSPOSE.get(image_orientation(image))
+    if transpose is None:
+        original = blob
+        image.draft('RGB', websize)
+    else:
+        image = image.transpose(transpose)
+        original = encode_image(image, fmt, quality=95)
+
+    web = downscale(image, websize)
+    webimg = encode_image(web, fmt, optimize=True, quality=settings.USERPROJECT_WEBIMG_QUALITY)
+    thumbnail = None
+    if thumbsize:
+        thumbnail = encode_image(downscale(web, thumbsize), fmt, optimize=True,
+                                 quality=settings.USERPROJECT_WEBIMG_QUALITY)
+    image.close()
+    return original, webimg, thumbnail
+
+
+def process_image(owner, note_id, im_dict, blob, thumbnail, stats=None):
+    """ build an ImageNote from an images record and its image data
+    The image, web image and thumbnail files are written to storage, the record itself is not saved.
+    The thumbnail made by geopaparazzi is used unless settings.USERPROJECT_THUMBNAIL_SIZE asks for
+    one to be made on the server, or the project has none for the image.
+    :param stats: optional IngestStats, takes the render and upload times of the image
+    :rtype: ImageNote
+    """
+    imgrcd = ImageNote(owner=owner, note_id=note_id, azimuth=im_dict['azim'])
+    # Note that ImageNote records have time and location distinct from the Note
+    imgrcd.timestamp = ms_to_datetime(im_dict['ts'])
+    imgrcd.lat = im_dict['lat']
+    imgrcd.lon = im_dict['lon']
+    imgrcd.location = Point(imgrcd.lon, imgrcd.lat)
+    imgrcd.altitude = im_dict['altim']
+
+    start = time.monotonic()
+    thumbsize = settings.USERPROJECT_THUMBNAIL_SIZE or (None if thumbnail else GPAP_THUMBNAIL_SIZE)
+    image, webimg, server_thumbnail = render_image(blob, thumbsize=thumbsize and (thumbsize, thumbsize))
+    rendered = time.monotonic()
+
+    # copy the files to storage
+    filename = os.path.basename(im_dict['text'])
+    thumbnail = server_thumbnail or thumbnail
+    imgrcd.image.save(filename, ContentFile(image), save=False)
+    imgrcd.webimg.save('web_{0}'.format(filename), ContentFile(webimg), save=False)
+    imgrcd.thumbnail.save('thm_{0}'.format(filename), ContentFile(thumbnail), save=False)
+    if stats is not None:
+        stats.add('image_render', count=1, nbytes=len(blob), seconds=rendered - start)
+        stats.add('image_upload', count=3, nbytes=len(image) + len(webimg) + len(thumbnail),
+                  seconds=time.monotonic() - rendered)
+    return imgrcd
+
+
+def safe_process_image(*args):
+    """ process_image for the worker pool - an image that can't be decoded is skipped rather than ending the ingest
+    :rtype: ImageNote or None
+    """
+    try:
+        return process_image(*args)
+    except (IOError, SyntaxError, TypeError, ValueError) as err:
+        logger.warning("Error processing image %s - %s", args[2]['text'], err)
+        return None
+
+
+def process_images(jobs, workers):
+    """ run safe_process_image over the jobs with a pool of threads, yielding the results in order
+    Pillow releases the GIL while it decodes, resizes and encodes, and the storage uploads are I/O bound,
+    so the images of a project are processed in parallel.  Only a few jobs are kept in flight at a time
+    so that the image data is not all read into memory at once.
+    :param jobs: iterable of argument tuples for process_image
+    :param workers: number of threads, with less than two the images are processed in the calling thread
+    """
+    if workers < 2:
+        for job in jobs:
+            yield safe_process_image(*job)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        inflight = deque()
+        for job in jobs:
+            inflight.append(pool.submit(safe_process_image, *job))
+            if len(inflight) >= 2 * workers:
+                yield inflight.popleft().result()
+        while inflight:
+            yield inflight.popleft().result()
+
+
+def resolve_note_ids(conn, owner, note_ids, wanted):
+    """ add the Note ids for sqlite notes that were not read by this ingest (older than its watermark)
+    :param note_ids: dict mapping the sqlite notes._id to the Note id, updated in place
+    :param wanted: the sqlite notes._id values that are needed
+    """
+    missing = [nt_id for nt_id in wanted if nt_id not in note_ids]
+    if not missing:
+        return
+    placeholders = ','.join('?' * len(missing))
+    by_ts = {ms_to_datetime(row['ts']): row['_id']
+             for row in conn.execute('SELECT _id, ts FROM notes WHERE _id IN ({0});'.format(placeholders), missing)}
+    for ts, note_id in Note.objects.filter(owner=owner, timestamp__in=list(by_ts)).values_list('timestamp', 'id'):
+        note_ids[by_ts[ts]] = note_id
+
+
+def import_images(conn, owner, note_ids, batch_size=None, workers=None, since=0, stats=None, failed=None):
+    """ import the images of a userproject, linked to the Notes they belong to
+    Images the owner already has are found with one query on the (timestamp, owner) key and skipped
+    before their image data is read.  The rest are processed in parallel by a pool of workers and
+    inserted in batches as they are finished, the Notes they refer to have already been committed.
+    Design Note:  presumes ImageNote records are _always_ referenced by a Note
+                  unreferenced records will not be imported
+    :param conn: sqlite3 connection to the userproject
+    :param owner: the User that owns the images
+    :param note_ids: dict mapping the sqlite notes._id to the Note id, as returned by import_notes
+    :param batch_size: number of images per insert, defaults to settings.USERPROJECT_NOTE_BATCH_SIZE
+    :param workers: number of images processed in parallel, defaults to settings.USERPROJECT_IMAGE_WORKERS
+    :param since: only images newer than this geopaparazzi timestamp are read
+    :param stats: optional IngestStats for the per image timings
+    :param failed: optional list, the geopaparazzi timestamps of images that could not be processed are added to it
+    :rtype: int, the number of images imported
+    """
+    batch_size = batch_size or settings.USERPROJECT_NOTE_BATCH_SIZE
+    workers = workers or settings.USERPROJECT_IMAGE_WORKERS
+    images = [dict(im) for im in conn.execute('SELECT * FROM images WHERE note_id IS NOT NULL AND ts > ? '
+                                              'ORDER BY ts ASC;', (since,))]
+    # a new image can belong to a note that was loaded by an earlier upload
+    resolve_note_ids(conn, owner, note_ids, {im['note_id'] for im in images})
+    images = [im for im in images if im['note_id'] in note_ids]
+    if not images:
+        return 0
+
+    start = ms_to_datetime(images[0]['ts'])
+    end = ms_to_datetime(images[-1]['ts'])
+    known = set(ImageNote.objects.filter(owner=owner, timestamp__range=(start, end))
+                .values_list('timestamp', flat=True))
+
+    def flush(records):
+        saved = bulk_save(ImageNote, records, batch_size)
+        for imgrcd in records:
+            if imgrcd.pk is None:  # lost a race with a concurrent upload, remove the orphaned files
+                imgrcd.image.delete(False)
+                imgrcd.thumbnail.delete(False)
+                imgrcd.webimg.delete(False)
+        return len(saved)
+
+    pending = deque()  # the timestamps of the jobs handed to process_images, whose results come back in order
+
+    def jobs():
+        # the image data is read here, in the calling thread, since the sqlite connection can't be shared
+        for im_dict in images:
+            ts = ms_to_datetime(im_dict['ts'])
+            if ts in known:
+                continue
+            known.add(ts)
+            img = conn.execute('SELECT data, thumbnail FROM imagedata WHERE _id=?;',
+                               (im_dict['imagedata_id'],)).fetchone()
+            if img is None:
+                continue
+            pending.append(im_dict['ts'])
+            yield owner, note_ids[im_dict['note_id']], im_dict, img['data'], img['thumbnail'], stats
+
+    imported = 0
+    batch = []
+    for imgrcd in process_images(jobs(), workers):
+        ts = pending.popleft()
+        if imgrcd is None:
+            if failed is not None:
+                failed.append(ts)
+            continue
+        batch.append(imgrcd)
+        if len(batch) >= batch_size:
+            imported += flush(batch)
+            batch = []
+    if batch:
+        imported += flush(batch)
+    return imported
+
+
+def project_device(conn):
+    """ identify the geopaparazzi project an upload came from
+    A project keeps its name and creation timestamp as it grows on a device, so later uploads of the
+    same project share a watermark while different projects (or devices) each get their own.
+    :rtype: string
+    """
+    try:
+        metadata = dict(conn.execute("SELECT key, value FROM metadata WHERE key IN ('name', 'creationts');"))
+    except sqlite3.DatabaseError:
+        return ''
+    return '{0} {1}'.format(metadata.get('name', ''), metadata.get('creationts', '')).strip()[:200]
+
+
+def activity_dates(owner, notes_since, images_since, gpslogs_since):
+    """ the days with features newer than the watermarks an ingest started from
+    :rtype: set of dates
+    """
+    dates = set(Note.objects.filter(owner=owner, timestamp__gt=ms_to_datetime(notes_since))
+                .dates('timestamp', 'day'))
+    dates.update(ImageNote.objects.filter(owner=owner, timestamp__gt=ms_to_datetime(images_since))
+                 .dates('timestamp', 'day'))
+    dates.update(TrackFeature.objects.filter(owner=owner, timestamp_start__gt=ms_to_datetime(gpslogs_since))
+                 .dates('timestamp_start', 'day'))
+    return dates
+
+
+def newest(conn, sql):
+    """ the result of a max() query on the userproject, 0 for an empty table """
+    return conn.execute(sql).fetchone()[0] or 0
+
+
+@app.task(bind=True)
+def LoadUserProject(self, userproject_file, ownerid, full=False):
     """ given an uploaded Geopaparazzi UserProject
     extract the useful bits and load them to the database
     :param userproject_file: name of the sqlite3 file to be read
     :param ownerid: id of the file owner
+    :param full: ignore the ingest watermark and read every record in the project
     :type arg1: string
     :type arg2: int
-    :rtype: None
+    :type arg3: bool
+    :rtype: dict, the IngestStats summary of the run
+
+    Geopaparazzi projects grow over time, so each upload holds everything collected so far.  An IngestWatermark
+    records the newest notes, gpslogs and images already loaded from each of the owner's projects, and
+    only records past it are read.  The watermark is only moved once an ingest has finished, and never past
+    an image that could not be processed.
+
+    Counts, bytes and timings for each phase are logged and published as the task's PROGRESS state.
 
     Since the userproject file and the images extracted from it may be managed by the Django-storages module (Boto)
     we have to take care to make local copies of all files accessed.
@@ -31,159 +543,82 @@ def LoadUserProject(userproject_file, ownerid):
     Also, since this task is intended for asynchronous execution via Celery, the calling parameters cannot be
     model instances (they are not JSON serializable!), so any model references have to be passed using primary keys
     """
-    # before we can open the database file, it must be copied locally!
-    document = default_storage.open(userproject_file, 'rb')
-    userproject = tempfile.NamedTemporaryFile(delete=False)
-    # this might be a memory problem!
-    data = document.read()
-    userproject.write(data)
-    userproject.close()
-
+    stats = IngestStats(self, userproject_file)
     # get the owner from the ownerid
     User = get_user_model()
     owner = User.objects.get(id=ownerid)
 
-    # connect to the database
-    conn = sqlite3.connect(userproject.name)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-
-    # import gpstracks if any
-    for gpslog in c.execute('SELECT * FROM gpslogs;'):
-        log_dict = dict(gpslog)
-        rcd = TrackFeature(owner=owner, text=log_dict['text'])
-        rcd.timestamp_start = datetime.utcfromtimestamp(log_dict['startts']/1000).replace(tzinfo=timezone.utc)
-        rcd.timestamp_end = datetime.utcfromtimestamp(log_dict['endts']/1000).replace(tzinfo=timezone.utc)
-        rcd.lengthm = log_dict['lengthm']
-        d = conn.cursor()
-        plist = []
-        for pt in d.execute('SELECT * FROM gpslogsdata WHERE logid=? ORDER BY ts ASC', (log_dict['_id'],)):
-            pt_dict = dict(pt)
-            plist.append(Point(pt_dict['lon'], pt_dict['lat']))
-        rcd.linestring = LineString(plist)
-        try:
-            with transaction.atomic():
-                rcd.save()
-        except IntegrityError:  # if the track is already in the database, catch the error and continue
-            pass
-        d.close()
-
-    # import notes and images together in order to preserve relationships
-    for nt in c.execute('SELECT * FROM notes;'):
-        nt_dict = dict(nt)
-        rcd = Note(owner=owner, text= nt_dict['text'], form = nt_dict['form'])
-        ts = datetime.utcfromtimestamp(nt_dict['ts']/1000).replace(tzinfo=timezone.utc)
-        print("processing note at {0}".format(ts))
-        rcd.timestamp = ts
-        rcd.description = nt_dict['description']
-        rcd.lat = nt_dict['lat']
-        rcd.lon = nt_dict['lon']
-        rcd.location = Point(rcd.lon, rcd.lat)
-        rcd.altitude = nt_dict['altim']
+    # every intermediate file lives in a private scratch directory that is removed when the ingest ends,
+    # whether or not it succeeds
+    with ScratchSpace() as scratch:
+        # before we can open the database file, it must be copied locally!
+        # the copy is streamed so that memory use does not grow with the size of the project
+        with stats.phase('download') as phase:
+            local_name = scratch.path('userproject.gpap', default_storage.size(userproject_file))
+            with open(local_name, 'wb') as userproject:
+                phase['bytes'] = copy_to_local(userproject_file, userproject)
+            phase['count'] = 1
+
+        # connect to the database
+        with stats.phase('sqlite_open'):
+            conn = sqlite3.connect(local_name)
+            conn.row_factory = sqlite3.Row
         try:
-            with transaction.atomic():
-                rcd.save()  # save the Note here so that we can refer to it when creating ImageNote records
-        except IntegrityError:  # if the Note is already in the database, catch the error and continue
-            print("Error saving note - already exists")
-            continue
+            with stats.phase('sqlite_open'):
+                watermark, created = IngestWatermark.objects.get_or_create(owner=owner, device=project_device(conn))
+            if full:
+                watermark.notes_ts = watermark.gpslogs_ts = watermark.images_ts = 0
 
-        d = conn.cursor()
-        # Import all Images linked to the current Note
-        # Design Note:  presumes ImageNote records are _always_ referenced by a Note
-        #               unreferenced records will not be imported
-        for im in d.execute('SELECT * FROM images WHERE note_id=?;', (nt_dict['_id'],)):
-            im_dict = dict(im)
-            imgrcd = ImageNote(owner=owner, note=rcd, azimuth=im_dict['azim'])
-            # Note that ImageNote records have time and location distinct from the Note
-            imgrcd.timestamp = datetime.utcfromtimestamp(im_dict['ts']/1000).replace(tzinfo=timezone.utc)
-            imgrcd.lat = im_dict['lat']
-            imgrcd.lon = im_dict['lon']
-            imgrcd.location = Point(imgrcd.lon, imgrcd.lat)
-            imgrcd.altitude = im_dict['altim']
-            e = conn.cursor()
-            e.execute('SELECT * FROM imagedata WHERE _id=?;', (im_dict['_id'],))
-            img = e.fetchone()
-            img_dict = dict(img)
-            # save the full image locally - this should probably be put in a temp directory
-            blob = img_dict['data']
-            local_filename = im_dict['text']
-            with open(local_filename, 'wb') as output_file:
-                output_file.write(blob)  # deleting the notes should automatically delete the imagenotes
-
-            # Rotate the image if an orientation tag is available
-            try:
-                print("opening image file {0}".format(local_filename))
-                image = Image.open(local_filename)
-                # this is a dumb way to find an integer from a dict but it works...
-                for orientation in ExifTags.TAGS.keys():
-                    if ExifTags.TAGS[orientation] == 'Orientation':
-                        break
-                exif = dict(image._getexif().items())
-
-                if exif[orientation] == 3:
-                    image = image.rotate(180, expand=True)
-                elif exif[orientation] == 6:
-                    image = image.rotate(270, expand=True)
-                elif exif[orientation] == 8:
-                    image = image.rotate(90, expand=True)
-                image.save(local_filename)
-                image.close()
-
-            except (AttributeError, KeyError, IndexError):
-                # cases: image don't have getexif
-                pass
+            # import gpstracks if any
+            with stats.phase('tracks') as phase:
+                phase['count'] = import_tracks(conn, owner, since=watermark.gpslogs_ts)
 
-            # create a web suitable resized image here
-            # TODO:  put the size and save options in the settings file
-            webimg_filename = 'web_{0}'.format(local_filename)
-            image = Image.open(local_filename)
-            websize = 480, 480
-            image.thumbnail(websize)
-            image.save(webimg_filename, optimize=True, quality=85)
-            image.close()
-
-            qf = open(local_filename, 'rb')
-            imgrcd.image = File(qf)
-            # the thumbnail - also should be placed in a temp directory
-            blob = img_dict['thumbnail']
-            thmname = 'thm_{0}'.format(local_filename)
-            with open(thmname, 'wb') as output_file:
-                output_file.write(blob)
-            qt = open(thmname, 'rb')
-            qw = open(webimg_filename, 'rb')
-            imgrcd.thumbnail = File(qt)
-            imgrcd.webimg = File(qw)
-            # save the newly created image record
-            try:
-                with transaction.atomic():
-                    imgrcd.save()
-            except IntegrityError:  # if the image is already in the database, catch the error and continue
-                pass
-            # clean up temporary image files
-            qf.close()
-            try:
-                os.remove(local_filename)
-            except OSError as err:
-                pass
+            # import notes and images together in order to preserve relationships
+            with stats.phase('notes') as phase:
+                note_ids = import_notes(conn, owner, since=watermark.notes_ts)
+                phase['count'] = len(note_ids)
+            with stats.phase('images') as phase:
+                failed = []
+                phase['count'] = import_images(conn, owner, note_ids, since=watermark.images_ts, stats=stats,
+                                               failed=failed)
 
-            qt.close()
-            try:
-                os.remove(thmname)
-            except OSError as err:
-                pass
+            # roll up the days that received new features
+            with stats.phase('activity') as phase:
+                dates = activity_dates(owner, watermark.notes_ts, watermark.images_ts, watermark.gpslogs_ts)
+                DailyActivity.recompute(owner.pk, dates)
+                phase['count'] = len(dates)
 
-            qw.close()
-            try:
-                os.remove(webimg_filename)
-            except OSError as err:
-                pass
+            watermark.gpslogs_ts = max(watermark.gpslogs_ts, newest(conn, 'SELECT max(startts) FROM gpslogs;'))
+            watermark.notes_ts = max(watermark.notes_ts, newest(conn, 'SELECT max(ts) FROM notes;'))
+            # the images stop short of the first one that could not be processed, so that it is tried again
+            # by the next upload - the images after it that were loaded are then skipped as known
+            images_ts = min(failed) - 1 if failed else newest(conn, 'SELECT max(ts) FROM images;')
+            watermark.images_ts = max(watermark.images_ts, images_ts)
+            watermark.save()
+            # the features were bulk created without post_save signals, so record the change here
+            bump_owner(owner.pk)
+        finally:
+            with stats.phase('cleanup'):
+                conn.close()
+                scratch.cleanup()
+    return stats.as_dict()
 
-    # clean up the temporary sqlite3 file
-    userproject.close()
-    try:
-        os.remove(userproject.name)
-    except OSError as err:
-        pass
+
+@app.task(acks_late=True)
+def AssembleUserProjectUpload(upload_id):
+    """ join the chunks of a finished resumable upload into a UserProject, which starts LoadUserProject
+    Reading back and storing a large project takes far longer than a request may, so it is done here once
+    the last chunk has been committed.  The task is acknowledged when it ends, so it runs again if the
+    worker is lost, and an upload that is already done or failed is left alone.
+    :param upload_id: the primary key of the UserProjectUpload
+    :rtype: None
+    """
+    from profiles.models import UserProjectUpload  # import here to avoid circular dependency
+    upload = UserProjectUpload.objects.filter(pk=upload_id, status=UserProjectUpload.ASSEMBLING).first()
+    if upload is None:
+        return
+    if upload.assemble() is None:
+        logger.warning("Upload %s of %s does not match its checksum", upload.pk, upload.filename)
 
 
 @app.task
@@ -192,12 +627,14 @@ def CleanUpOldProjects(interval):
     :param interval: number of days the data will be retained
     :rtype: None
     """
-    from profiles.models import UserProject # import here to avoid circular dependency
+    from profiles.models import UserProject, UserProjectUpload # import here to avoid circular dependency
     cutoff = datetime.now(timezone.utc) - timedelta(days=interval)
 
     print("Clean up projects. pruning data older than {0}".format(cutoff))
     cut_user_projects = UserProject.objects.filter(modifieddate__lt=cutoff)
+    cut_uploads = UserProjectUpload.objects.filter(modifieddate__lt=cutoff)
 
-    print("Deleting {0} user projects".format(cut_user_projects.count()))
+    print("Deleting {0} user projects and {1} uploads".format(cut_user_projects.count(), cut_uploads.count()))
     cut_user_projects.delete()
+    cut_uploads.delete()  # deleting the uploads also removes any chunks that were never assembled
 
@@ -1,14 +1,19 @@
+import base64
+import hashlib
+from unittest import mock
 from django.test import TestCase
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
-from ..models import Project, Tag, Basemap, Spatialitedbs, Otherfiles, Profile
+from ..models import Project, Tag, Basemap, Spatialitedbs, Otherfiles, Profile, UserProject, UserProjectUpload
+from ..tasks import AssembleUserProjectUpload
 from ..serializers import ProjectSerializer, TagSerializer, BasemapSerializer, SpatialitedbsSerializer, \
     OtherfilesSerializer, ProfileSerializer
 from django.core.exceptions import ObjectDoesNotExist
 import tempfile
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import override_settings
+from geotabloid.testing import capture_on_commit_callbacks
 from geotabloid.users.tests.factories import UserFactory
 
 
@@ -107,6 +112,20 @@ class GetAllProfiles(APITestCase):
         response = self.client.get(reverse('project-detail', kwargs={'pk': 30}))
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_conditional_get(self):
+        self.client.force_authenticate(self.user1)
+        response = self.client.get(reverse('project-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        response = self.client.get(reverse('project-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # any change to the profiles is a new version
+        with capture_on_commit_callbacks(execute=True):
+            self.basemap.save()
+        response = self.client.get(reverse('project-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
     def test_get_all_tags(self):
         self.client.force_authenticate(self.user1)
         response = self.client.get(reverse('tag-list'))
@@ -211,3 +230,103 @@ class GetAllProfiles(APITestCase):
         self.client.force_authenticate(self.user1)
         response = self.client.get(reverse('profile-detail', kwargs={'pk': 30}))
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+class UserProjectUploadTestCase(APITestCase):
+    def setUp(self):
+        self.user1 = UserFactory.build()
+        self.user1.save()
+        self.client.force_authenticate(self.user1)
+        self.data = b'some example data for our chunked upload'
+
+    def start(self, checksum=''):
+        response = self.client.post(reverse('userprojectupload-list'),
+                                    data={'filename': 'chunked.gpap', 'length': len(self.data), 'checksum': checksum})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response['Upload-Offset'], '0')
+        return reverse('userprojectupload-detail', kwargs={'pk': response.data['id']})
+
+    def send(self, url, chunk, offset, **headers):
+        return self.client.patch(url, data=chunk, content_type='application/offset+octet-stream',
+                                 HTTP_UPLOAD_OFFSET=str(offset), **headers)
+
+    def assemble(self, url):
+        """ run the assembly the last chunk leaves to a worker, and poll the upload """
+        upload_id = url.rstrip('/').split('/')[-1]
+        self.assertEqual(UserProjectUpload.objects.get(pk=upload_id).status, UserProjectUpload.ASSEMBLING)
+        AssembleUserProjectUpload(upload_id)
+        return self.client.get(url)
+
+    @mock.patch('profiles.models.LoadUserProject')
+    def test_resumable_upload(self, load):
+        url = self.start(checksum=hashlib.sha256(self.data).hexdigest())
+        response = self.send(url, self.data[:10], 0)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        # a retried chunk at a stale offset is refused and the client is told where to resume
+        response = self.send(url, self.data[:10], 0)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.client.head(url)['Upload-Offset'], '10')
+        self.assertFalse(load.delay.called)
+        # the last chunk is only stored, the file is assembled outside the request
+        response = self.send(url, self.data[10:], 10)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'assembling')
+        self.assertIsNone(response.data['userproject'])
+        self.assertFalse(load.delay.called)
+        response = self.assemble(url)
+        self.assertEqual(response.data['status'], 'done')
+        upload = UserProjectUpload.objects.get(pk=response.data['id'])
+        self.assertEqual(upload.userproject.document.read(), self.data)
+        self.assertEqual(load.delay.call_count, 1)
+        # a second run of the task leaves the finished upload alone
+        AssembleUserProjectUpload(str(upload.pk))
+        self.assertEqual(load.delay.call_count, 1)
+
+    @mock.patch('profiles.models.LoadUserProject')
+    def test_chunk_checksum(self, load):
+        url = self.start()
+        bad = 'sha256 ' + base64.b64encode(hashlib.sha256(b'something else').digest()).decode()
+        response = self.send(url, self.data, 0, HTTP_UPLOAD_CHECKSUM=bad)
+        self.assertEqual(response.status_code, 460)
+        good = 'sha256 ' + base64.b64encode(hashlib.sha256(self.data).digest()).decode()
+        response = self.send(url, self.data, 0, HTTP_UPLOAD_CHECKSUM=good)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+    @mock.patch('profiles.models.LoadUserProject')
+    def test_file_checksum_mismatch(self, load):
+        url = self.start(checksum=hashlib.sha256(b'something else').hexdigest())
+        response = self.send(url, self.data, 0)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        response = self.assemble(url)
+        self.assertEqual(response.data['status'], 'failed')
+        self.assertFalse(load.delay.called)
+        self.assertFalse(UserProject.objects.exists())
+
+    def test_oversized_chunk(self):
+        url = self.start()
+        response = self.send(url, self.data + b'extra', 0)
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+class UserProjectDuplicateTestCase(APITestCase):
+    def setUp(self):
+        self.user1 = UserFactory.build()
+        self.user1.save()
+        self.client.force_authenticate(self.user1)
+
+    def post(self, data):
+        document = SimpleUploadedFile('project.gpap', data)
+        return self.client.post(reverse('userproject-list'), data={'document': document}, format='multipart')
+
+    @mock.patch('profiles.models.LoadUserProject')
+    def test_identical_upload_is_stored_once(self, load):
+        self.assertEqual(self.post(b'some project').status_code, status.HTTP_201_CREATED)
+        response = self.post(b'some project')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['sha256'], hashlib.sha256(b'some project').hexdigest())
+        self.assertEqual(UserProject.objects.filter(owner=self.user1).count(), 1)
+        self.assertEqual(load.delay.call_count, 1)
+        self.assertEqual(self.post(b'another project').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(load.delay.call_count, 2)
@@ -1,12 +1,15 @@
 from django.test import TestCase
 from django.urls import reverse
-from ..models import Project, Tag, Basemap, Spatialitedbs, Otherfiles, Profile, UserProject, ProfileSet
+from ..models import Project, Tag, Basemap, Spatialitedbs, Otherfiles, Profile, UserProject, ProfileSet, \
+    delete_profile_items, profileset_scope
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.gis.geos import Point
 import tempfile
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import override_settings
 from geotabloid.users.tests.factories import UserFactory
+from geotabloid.testing import capture_on_commit_callbacks
+from geotabloid.versioning import get_stamp
 
 # Some tests of the various models for the geopaparazzi cloud profile services
 @override_settings(MEDIA_ROOT=tempfile.gettempdir()) 
@@ -168,3 +171,13 @@ class TestProfileSet(TestCase):
     def test_create_profile(self):
         self.assertIsInstance(self.profileset, ProfileSet)
 
+    def test_delete_profile_items(self):
+        before = get_stamp(profileset_scope(self.profileset.pk))
+        with capture_on_commit_callbacks(execute=True):
+            delete_profile_items(Basemap.objects.all())
+        after = get_stamp(profileset_scope(self.profileset.pk))
+        self.assertGreater(after, before)
+        # the set and the profiles scope are bumped together, once
+        self.assertEqual(after, get_stamp('profiles'))
+        self.assertFalse(Basemap.objects.exists())
+
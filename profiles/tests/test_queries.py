@@ -0,0 +1,67 @@
+import tempfile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from ..models import Project, Tag, Basemap, Spatialitedbs, Otherfiles, Profile, ProfileSet
+from geotabloid.testing import QueryBudgetMixin, capture_on_commit_callbacks
+from geotabloid.users.tests.factories import UserFactory
+
+
+# the profile endpoints must not run a query per profile
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+class ProfileQueriesTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user1 = UserFactory.build()
+        self.user1.save()
+        self.client.force_authenticate(user=self.user1)
+        self.document = SimpleUploadedFile('test.txt', b'some example data for our file')
+        self.profileset = ProfileSet.objects.create(owner=self.user1)
+
+    def add_profiles(self, count):
+        for i in range(count):
+            project = Project.objects.create(path='project.gpap', url=self.document)
+            tag = Tag.objects.create(path='tags.json', url=self.document, owner=self.user1)
+            profile = Profile.objects.create(name='test', description='test profile', project=project, tags=tag)
+            profile.basemaps.add(Basemap.objects.create(path='basemap.mbtiles', url=self.document))
+            profile.spatialitedbs.add(Spatialitedbs.objects.create(path='trails.sqlite', url=self.document))
+            profile.otherfiles.add(Otherfiles.objects.create(path='other.pdf', url=self.document))
+            self.profileset.profiles.add(profile)
+
+    @override_settings(MANIFEST_CACHE_TIMEOUT=0)
+    def test_myprofiles(self):
+        # with the manifest cache off, so the manifest is built for every request
+        self.assertQueriesConstant(reverse('myprofiles'), self.add_profiles)
+
+    def test_myprofiles_cached(self):
+        self.add_profiles(2)
+        url = reverse('myprofiles')
+        self.count_queries(url)
+        # only the ProfileSet is looked up, the manifest comes from the cache
+        self.assertEqual(self.count_queries(url), 1)
+        # until a change to something in it is committed
+        with capture_on_commit_callbacks() as callbacks:
+            Basemap.objects.first().save()
+        self.assertEqual(self.count_queries(url), 1)
+        for callback in callbacks:
+            callback()
+        self.assertGreater(self.count_queries(url), 1)
+        # changes to files that are not in the manifest are ignored
+        with capture_on_commit_callbacks(execute=True):
+            Basemap.objects.create(path='unused.mbtiles', url=self.document)
+        self.assertEqual(self.count_queries(url), 1)
+
+    def test_myprofiles_cached_per_scheme(self):
+        self.add_profiles(1)
+        url = reverse('myprofiles')
+        response = self.client.get(url)
+        self.assertNotIn('https://', response.content.decode())
+        # the absolute urls of an https manifest are not served from the http one
+        response = self.client.get(url, secure=True)
+        self.assertIn('https://', response.content.decode())
+
+    def test_profiles(self):
+        self.assertQueriesConstant(reverse('profile-list'), self.add_profiles)
+
+    def test_tags(self):
+        self.assertQueriesConstant(reverse('tag-list'), self.add_profiles)
@@ -0,0 +1,295 @@
+import io
+import os
+import sqlite3
+import struct
+import tempfile
+from PIL import Image
+from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import override_settings
+from django.contrib.gis.geos import Point
+from gp_projects.models import ImageNote, IngestWatermark, Note, TrackFeature
+from geotabloid.users.tests.factories import UserFactory
+from ..instrumentation import IngestStats
+from ..tasks import LoadUserProject, ScratchSpace, copy_to_local, gpslog_linestring, import_images, import_notes, \
+    import_tracks, ms_to_datetime, process_image, render_image
+
+
+def make_userproject(name=':memory:'):
+    """ a sqlite database (in memory unless a file name is given) with the geopaparazzi tables used by the ingest """
+    conn = sqlite3.connect(name)
+    conn.row_factory = sqlite3.Row
+    conn.executescript("""
+        CREATE TABLE gpslogs (_id INTEGER PRIMARY KEY AUTOINCREMENT, startts LONG NOT NULL, endts LONG NOT NULL,
+                              lengthm REAL NOT NULL, isdirty INTEGER NOT NULL, text TEXT NOT NULL);
+        CREATE TABLE gpslogsdata (_id INTEGER PRIMARY KEY AUTOINCREMENT, lon REAL NOT NULL, lat REAL NOT NULL,
+                                  altim REAL NOT NULL, ts DATE NOT NULL, logid INTEGER NOT NULL);
+        CREATE TABLE notes (_id INTEGER PRIMARY KEY AUTOINCREMENT, lon REAL NOT NULL, lat REAL NOT NULL,
+                            altim REAL NOT NULL, ts DATE NOT NULL, description TEXT, text TEXT NOT NULL,
+                            form CLOB, style TEXT, isdirty INTEGER);
+        CREATE TABLE images (_id INTEGER PRIMARY KEY AUTOINCREMENT, lon REAL NOT NULL, lat REAL NOT NULL,
+                             altim REAL NOT NULL, azim REAL NOT NULL, imagedata_id INTEGER NOT NULL,
+                             ts DATE NOT NULL, text TEXT NOT NULL, note_id INTEGER, isdirty INTEGER NOT NULL);
+        CREATE TABLE imagedata (_id INTEGER PRIMARY KEY AUTOINCREMENT, data BLOB NOT NULL, thumbnail BLOB NOT NULL);
+    """)
+    return conn
+
+
+def add_gpslog(conn, startts, points):
+    cursor = conn.execute('INSERT INTO gpslogs (startts, endts, lengthm, isdirty, text) VALUES (?, ?, ?, 0, ?)',
+                          (startts, startts + 1000 * len(points), 10.5, 'log {0}'.format(startts)))
+    for i, (lon, lat) in enumerate(points):
+        conn.execute('INSERT INTO gpslogsdata (lon, lat, altim, ts, logid) VALUES (?, ?, 0, ?, ?)',
+                     (lon, lat, startts + 1000 * i, cursor.lastrowid))
+    return cursor.lastrowid
+
+
+def add_note(conn, ts, images=0):
+    cursor = conn.execute('INSERT INTO notes (lon, lat, altim, ts, description, text, form) '
+                          'VALUES (-114.38, 52.12, 1105.5, ?, ?, ?, ?)', (ts, 'POI', 'note {0}'.format(ts), '{}'))
+    note_id = cursor.lastrowid
+    for i in range(images):
+        blob = io.BytesIO()
+        Image.new('RGB', (64, 48), 'red').save(blob, 'JPEG')
+        data = conn.execute('INSERT INTO imagedata (data, thumbnail) VALUES (?, ?)',
+                            (blob.getvalue(), blob.getvalue()))
+        conn.execute('INSERT INTO images (lon, lat, altim, azim, imagedata_id, ts, text, note_id, isdirty) '
+                     'VALUES (-114.38, 52.12, 1105.5, 90, ?, ?, ?, ?, 0)',
+                     (data.lastrowid, ts + i + 1, 'IMG_{0}_{1}.jpg'.format(ts, i), note_id))
+    return note_id
+
+
+# Some tests of the userproject ingest helpers
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+class TestCopyToLocal(TestCase):
+    def setUp(self):
+        self.data = os.urandom(10000)
+        self.name = default_storage.save('test_copy_to_local.gpap', ContentFile(self.data))
+
+    def tearDown(self):
+        default_storage.delete(self.name)
+
+    def test_copy_in_chunks(self):
+        with tempfile.TemporaryFile() as destination:
+            copied = copy_to_local(self.name, destination, chunk_size=1024)
+            destination.seek(0)
+            self.assertEqual(copied, len(self.data))
+            self.assertEqual(destination.read(), self.data)
+
+    @override_settings(USERPROJECT_COPY_CHUNK_SIZE=4096)
+    def test_default_chunk_size(self):
+        with tempfile.TemporaryFile() as destination:
+            self.assertEqual(copy_to_local(self.name, destination), len(self.data))
+
+
+class TestScratchSpace(TestCase):
+    def setUp(self):
+        self.tmpfs = tempfile.mkdtemp()
+        self.disk = tempfile.mkdtemp()
+
+    def tearDown(self):
+        os.rmdir(self.tmpfs)
+        os.rmdir(self.disk)
+
+    def test_budget_and_cleanup(self):
+        with ScratchSpace(tmpfs=self.tmpfs, budget=1000, root=self.disk) as scratch:
+            small = scratch.path('small.gpap', 600)
+            large = scratch.path('large.gpap', 600)
+            self.assertTrue(small.startswith(self.tmpfs))
+            self.assertTrue(large.startswith(self.disk))
+            for name in (small, large):
+                with open(name, 'wb') as f:
+                    f.write(b'x')
+        self.assertFalse(os.path.exists(small))
+        self.assertFalse(os.path.exists(large))
+
+    def test_concurrent_workspaces_are_separate(self):
+        with ScratchSpace(tmpfs='', root=self.disk) as first, ScratchSpace(tmpfs='', root=self.disk) as second:
+            self.assertNotEqual(first.path('IMG_1.jpg'), second.path('IMG_1.jpg'))
+
+    def test_cleanup_on_error(self):
+        with self.assertRaises(ValueError):
+            with ScratchSpace(tmpfs='', root=self.disk) as scratch:
+                name = scratch.path('userproject.gpap')
+                open(name, 'wb').close()
+                raise ValueError
+        self.assertFalse(os.path.exists(name))
+
+
+class TestImportTracks(TestCase):
+    def setUp(self):
+        self.owner = UserFactory.build()
+        self.owner.save()
+        self.conn = make_userproject()
+        self.points = [(-114.38, 52.12), (-114.381, 52.123), (-114.389, 52.123), (-114.386, 52.119)]
+
+    def test_gpslog_linestring(self):
+        logid = add_gpslog(self.conn, 1526000000000, self.points)
+        linestring = gpslog_linestring(self.conn, logid)
+        self.assertEqual(linestring.geom_type, 'LineString')
+        self.assertEqual(linestring.tuple, tuple(self.points))
+
+    def test_gpslog_linestring_too_short(self):
+        logid = add_gpslog(self.conn, 1526000000000, self.points[:1])
+        self.assertIsNone(gpslog_linestring(self.conn, logid))
+
+    def test_import_skips_duplicates(self):
+        for i in range(3):
+            add_gpslog(self.conn, 1526000000000 + i * 60000, self.points)
+        self.assertEqual(import_tracks(self.conn, self.owner, batch_size=2), 3)
+        self.assertEqual(import_tracks(self.conn, self.owner, batch_size=2), 0)
+        self.assertEqual(TrackFeature.objects.filter(owner=self.owner).count(), 3)
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+class TestImportNotes(TestCase):
+    def setUp(self):
+        self.owner = UserFactory.build()
+        self.owner.save()
+        self.conn = make_userproject()
+
+    def test_import_notes_and_images(self):
+        first = add_note(self.conn, 1526000000000, images=2)
+        second = add_note(self.conn, 1526000060000)
+        note_ids = import_notes(self.conn, self.owner, batch_size=1)
+        self.assertEqual(set(note_ids), {first, second})
+        self.assertEqual(import_images(self.conn, self.owner, note_ids, batch_size=1), 2)
+        self.assertEqual(ImageNote.objects.filter(note_id=note_ids[first]).count(), 2)
+
+    def test_import_images_in_parallel(self):
+        note = add_note(self.conn, 1526000000000, images=5)
+        note_ids = import_notes(self.conn, self.owner)
+        self.assertEqual(import_images(self.conn, self.owner, note_ids, batch_size=2, workers=3), 5)
+        self.assertEqual(ImageNote.objects.filter(note_id=note_ids[note]).count(), 5)
+
+    def test_reimport_is_skipped(self):
+        note = add_note(self.conn, 1526000000000, images=1)
+        note_ids = import_notes(self.conn, self.owner)
+        import_images(self.conn, self.owner, note_ids)
+        # a second upload of the same project maps onto the existing rows without inserting anything
+        self.assertEqual(import_notes(self.conn, self.owner), note_ids)
+        self.assertEqual(import_images(self.conn, self.owner, note_ids), 0)
+        self.assertEqual(Note.objects.filter(owner=self.owner).count(), 1)
+        self.assertEqual(ImageNote.objects.filter(owner=self.owner, note_id=note_ids[note]).count(), 1)
+
+    def test_image_without_thumbnail(self):
+        # a thumbnail is made for an image the project has none for
+        note = Note.objects.create(location=Point(-114.38, 52.12), lat=52.12, lon=-114.38, owner=self.owner,
+                                   timestamp=ms_to_datetime(1526000000000))
+        im_dict = {'azim': 90, 'ts': 1526000000001, 'lat': 52.12, 'lon': -114.38, 'altim': 1105.5,
+                   'text': 'IMG_no_thumbnail.jpg'}
+        imgrcd = process_image(self.owner, note.pk, im_dict, make_jpeg((640, 480)), None)
+        self.assertTrue(imgrcd.thumbnail.name)
+        self.assertEqual(Image.open(default_storage.open(imgrcd.thumbnail.name)).size, (100, 75))
+
+    def test_import_since_watermark(self):
+        first = add_note(self.conn, 1526000000000, images=1)
+        note_ids = import_notes(self.conn, self.owner)
+        import_images(self.conn, self.owner, note_ids)
+        # the project grows: a new note, and a new image on the note that was already loaded
+        second = add_note(self.conn, 1526000060000)
+        self.conn.execute('UPDATE images SET ts = ? WHERE note_id = ?', (1526000070000, first))
+        note_ids = import_notes(self.conn, self.owner, since=1526000000000)
+        self.assertEqual(set(note_ids), {second})
+        self.assertEqual(import_images(self.conn, self.owner, note_ids, since=1526000060000), 1)
+        self.assertEqual(ImageNote.objects.filter(owner=self.owner, note__text='note 1526000000000').count(), 2)
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir(), USERPROJECT_IMAGE_WORKERS=1)
+class TestLoadUserProject(TestCase):
+    def setUp(self):
+        self.owner = UserFactory.build()
+        self.owner.save()
+        self.name = 'test_load_userproject.gpap'
+        self.conn = make_userproject(default_storage.path(self.name))
+
+    def tearDown(self):
+        self.conn.close()
+        default_storage.delete(self.name)
+
+    def load(self):
+        self.conn.commit()
+        return LoadUserProject(self.name, self.owner.id)['phases']
+
+    def test_incremental_load_retries_failed_images(self):
+        add_note(self.conn, 1526000000000, images=2)
+        # the second image of the note can't be decoded
+        self.conn.execute("UPDATE imagedata SET data = ? WHERE _id = "
+                          "(SELECT imagedata_id FROM images WHERE ts = ?)", (b'not an image', 1526000000002))
+        phases = self.load()
+        self.assertEqual(phases['notes']['count'], 1)
+        self.assertEqual(phases['images']['count'], 1)
+        watermark = IngestWatermark.objects.get(owner=self.owner)
+        self.assertEqual(watermark.notes_ts, 1526000000000)
+        self.assertEqual(watermark.images_ts, 1526000000001)
+
+        # the next upload has the image repaired and a new note: only those rows are imported
+        self.conn.execute("UPDATE imagedata SET data = thumbnail")
+        add_note(self.conn, 1526000060000, images=1)
+        phases = self.load()
+        self.assertEqual(phases['notes']['count'], 1)
+        self.assertEqual(phases['images']['count'], 2)
+        self.assertEqual(Note.objects.filter(owner=self.owner).count(), 2)
+        self.assertEqual(ImageNote.objects.filter(owner=self.owner).count(), 3)
+        watermark.refresh_from_db()
+        self.assertEqual(watermark.images_ts, 1526000060001)
+
+        # and a third upload of the same project has nothing new
+        phases = self.load()
+        self.assertEqual(phases['notes']['count'], 0)
+        self.assertEqual(phases['images']['count'], 0)
+
+
+def make_jpeg(size, orientation=None):
+    """ a JPEG image, with an EXIF orientation tag if one is given """
+    options = {}
+    if orientation:
+        tiff = b'II*\x00' + struct.pack('<IH', 8, 1) + struct.pack('<HHIHH', 274, 3, 1, orientation, 0) + \
+            struct.pack('<I', 0)
+        options['exif'] = b'Exif\x00\x00' + tiff
+    blob = io.BytesIO()
+    Image.new('RGB', size, 'blue').save(blob, 'JPEG', **options)
+    return blob.getvalue()
+
+
+class TestRenderImage(TestCase):
+    def test_upright_image_is_stored_as_uploaded(self):
+        blob = make_jpeg((1600, 1200))
+        image, webimg, thumbnail = render_image(blob, websize=(480, 480))
+        self.assertEqual(image, blob)
+        self.assertEqual(Image.open(io.BytesIO(webimg)).size, (480, 360))
+        self.assertIsNone(thumbnail)
+
+    def test_rotated_image(self):
+        blob = make_jpeg((1600, 1200), orientation=6)
+        image, webimg, thumbnail = render_image(blob, websize=(480, 480), thumbsize=(100, 100))
+        self.assertEqual(Image.open(io.BytesIO(image)).size, (1200, 1600))
+        self.assertEqual(Image.open(io.BytesIO(webimg)).size, (360, 480))
+        self.assertEqual(Image.open(io.BytesIO(thumbnail)).size, (75, 100))
+
+
+class TestIngestStats(TestCase):
+    def test_phases(self):
+        stats = IngestStats(name='test.gpap')
+        with stats.phase('notes') as phase:
+            phase['count'] = 10
+        stats.add('image_render', count=1, nbytes=2048, seconds=0.5)
+        stats.add('image_render', count=1, nbytes=1024, seconds=0.5)
+        summary = stats.as_dict()
+        self.assertEqual(summary['userproject'], 'test.gpap')
+        self.assertEqual(list(summary['phases']), ['notes', 'image_render'])
+        self.assertEqual(summary['phases']['notes']['count'], 10)
+        self.assertEqual(summary['phases']['image_render']['bytes'], 3072)
+        self.assertEqual(summary['phases']['image_render']['rate'], 2.0)
+
+    def test_reused_phase(self):
+        stats = IngestStats(name='test.gpap')
+        with stats.phase('sqlite_open') as phase:
+            phase['count'] = 1
+        first = stats.as_dict()['phases']['sqlite_open']['seconds']
+        with stats.phase('sqlite_open') as phase:
+            phase['count'] = 1
+        summary = stats.as_dict()['phases']['sqlite_open']
+        self.assertEqual(summary['count'], 2)
+        self.assertGreaterEqual(summary['seconds'], first)
@@ -0,0 +1,35 @@
+import tempfile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from ..models import Basemap
+from ..stats import catalog_stats
+from geotabloid.testing import capture_on_commit_callbacks
+from geotabloid.users.tests.factories import UserFactory
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+class CatalogTestCase(TestCase):
+    def setUp(self):
+        self.user1 = UserFactory.build()
+        self.user1.save()
+        self.client.force_login(self.user1)
+
+    def test_empty_catalog(self):
+        # the tables are empty, so there are no latest dates
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['num_basemaps'], 0)
+        self.assertEqual(response.context['last_rcd'], '')
+
+    def test_stats(self):
+        stats = catalog_stats()
+        self.assertEqual(stats['num_users'], 1)
+        # a change to the profiles is counted straight away
+        with capture_on_commit_callbacks(execute=True):
+            basemap = Basemap.objects.create(path='basemap.mbtiles', url=SimpleUploadedFile('test.txt', b'data'))
+        stats = catalog_stats()
+        self.assertEqual(stats['num_basemaps'], 1)
+        self.assertEqual(stats['last_rcd'], basemap.modifieddate)
+        with self.assertNumQueries(0):
+            catalog_stats()
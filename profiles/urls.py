@@ -20,6 +20,8 @@ urlpatterns = [
     url(r'^otherfiles/$', views.OtherfilesList.as_view(), name='otherfile-list'),
     url(r'^otherfiles/(?P<pk>[0-9]+)/$', views.OtherfilesDetail.as_view(), name='otherfile-detail'),
     url(r'^projects/upload/(?P<filename>[^/]+)$', views.FileUploadView.as_view()),
+    url(r'^uploads/$', views.UserProjectUploadList.as_view(), name='userprojectupload-list'),
+    url(r'^uploads/(?P<pk>[0-9a-f-]+)/$', views.UserProjectUploadDetail.as_view(), name='userprojectupload-detail'),
     # allow authentication via REST
     url(r'^api-auth/', include('rest_framework.urls')),
     # HTML urls
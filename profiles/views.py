@@ -1,19 +1,45 @@
+import base64
+import hashlib
+import tempfile
+from django.conf import settings
 from django.contrib.gis.db.models import Value, URLField
+from django.core.cache import cache
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from django.shortcuts import get_object_or_404, render
-from profiles.models import Project, Tag, Basemap, Spatialitedbs, Otherfiles, Profile, ProfileSet, UserProject
-from profiles.serializers import ProjectSerializer, TagSerializer, BasemapSerializer, UserProjectSerializer
+from profiles.models import Project, Tag, Basemap, Spatialitedbs, Otherfiles, Profile, ProfileSet, UserProject, \
+    UserProjectUpload, file_sha256, profileset_scope
+from profiles.serializers import ProjectSerializer, TagSerializer, BasemapSerializer, UserProjectSerializer, \
+    UserProjectUploadSerializer
 from profiles.serializers import SpatialitedbsSerializer, OtherfilesSerializer, ProfileSerializer, ProfileSetSerializer
+from profiles.stats import catalog_stats
+from profiles.tasks import AssembleUserProjectUpload
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.response import Response
-from rest_framework import generics, permissions
+from rest_framework import generics, permissions, status
 from rest_framework.parsers import FileUploadParser, FormParser, MultiPartParser
 from rest_framework.reverse import reverse
-from django.contrib.auth import get_user_model
-from django.core.exceptions import ObjectDoesNotExist
+from geotabloid.versioning import ConditionalGetMixin, get_stamp
 
 
-class MyProfiles(generics.RetrieveAPIView):
+class ProfilesConditionalGetMixin(ConditionalGetMixin):
+    """ conditional GET on the profiles, which are shared by every user """
+    version_scopes = ('profiles',)
+
+
+# the profiles with everything the nested ProfileSerializer reads, fetched in a fixed number of queries
+PROFILE_QUERYSET = Profile.objects.select_related('project', 'tags') \
+    .prefetch_related('basemaps', 'spatialitedbs', 'otherfiles')
+
+
+class MyProfiles(ProfilesConditionalGetMixin, generics.RetrieveAPIView):
+    """
+    The manifest of the profiles a Geopaparazzi device may download.
+    The manifest is built once for each ProfileSet and host, and served from the cache until
+    something it includes changes.
+    """
     #    queryset = ProfileList.objects.all
     serializer_class = ProfileSetSerializer
 
@@ -26,46 +52,65 @@ class MyProfiles(generics.RetrieveAPIView):
     # only return ProfileSets that are linked to the user
     # for anonymous requests, return anything marked as public
     def get_object(self):
-        queryset = self.get_queryset()
-        if self.request.user.is_authenticated:
-            obj = get_object_or_404(queryset, owner=self.request.user)
-        else:
-            # User = get_user_model()
-            obj = get_object_or_404(queryset, public=True)
-        return obj
-
-
-class ProfileList(generics.ListCreateAPIView):
+        """ the ProfileSet, looked up once per request and without its profiles - they are only loaded
+        when the manifest is not in the cache """
+        if not hasattr(self, '_profileset'):
+            queryset = self.get_queryset()
+            if self.request.user.is_authenticated:
+                obj = get_object_or_404(queryset, owner=self.request.user)
+            else:
+                # User = get_user_model()
+                obj = get_object_or_404(queryset, public=True)
+            self._profileset = obj
+        return self._profileset
+
+    def get_version_scopes(self):
+        return (profileset_scope(self.get_object().pk),)
+
+    def retrieve(self, request, *args, **kwargs):
+        profileset = self.get_object()
+        # the file urls in the manifest are absolute, so they depend on the scheme and host
+        key = 'manifest:{0}:{1}:{2}'.format(profileset.pk, get_stamp(profileset_scope(profileset.pk)),
+                                            request.build_absolute_uri('/'))
+        data = cache.get(key)
+        if data is None:
+            prefetch_related_objects([profileset], Prefetch('profiles', queryset=PROFILE_QUERYSET))
+            data = dict(self.get_serializer(profileset).data)
+            cache.set(key, data, settings.MANIFEST_CACHE_TIMEOUT)
+        return Response(data)
+
+
+class ProfileList(ProfilesConditionalGetMixin, generics.ListCreateAPIView):
     """
     Returns a list of all available profiles.
     Profiles are actually SQLite database files set up for
     data collection with Geopaparazzi by an administrator.
     """
-    queryset = Profile.objects.all()
+    queryset = PROFILE_QUERYSET
     serializer_class = ProfileSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
 
-class ProfileDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Profile.objects.all()
+class ProfileDetail(ProfilesConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = PROFILE_QUERYSET
     serializer_class = ProfileSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
 
-class ProjectList(generics.ListCreateAPIView):
+class ProjectList(ProfilesConditionalGetMixin, generics.ListCreateAPIView):
     queryset = Project.objects.all()
     serializer_class = ProjectSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
 
-class ProjectDetail(generics.RetrieveUpdateDestroyAPIView):
+class ProjectDetail(ProfilesConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Project.objects.all()
     serializer_class = ProjectSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
 
-class TagList(generics.ListCreateAPIView):
-    queryset = Tag.objects.all()
+class TagList(ProfilesConditionalGetMixin, generics.ListCreateAPIView):
+    queryset = Tag.objects.select_related('owner')
     serializer_class = TagSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
@@ -73,43 +118,43 @@ class TagList(generics.ListCreateAPIView):
         serializer.save(owner=self.request.user)
 
 
-class TagDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Tag.objects.all()
+class TagDetail(ProfilesConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = Tag.objects.select_related('owner')
     serializer_class = TagSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
 
-class BasemapList(generics.ListCreateAPIView):
+class BasemapList(ProfilesConditionalGetMixin, generics.ListCreateAPIView):
     queryset = Basemap.objects.all()
     serializer_class = BasemapSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
 
-class BasemapDetail(generics.RetrieveUpdateDestroyAPIView):
+class BasemapDetail(ProfilesConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Basemap.objects.all()
     serializer_class = BasemapSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
 
-class SpatialitedbsList(generics.ListCreateAPIView):
+class SpatialitedbsList(ProfilesConditionalGetMixin, generics.ListCreateAPIView):
     queryset = Spatialitedbs.objects.all()
     serializer_class = SpatialitedbsSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
 
-class SpatialitedbsDetail(generics.RetrieveUpdateDestroyAPIView):
+class SpatialitedbsDetail(ProfilesConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Spatialitedbs.objects.all()
     serializer_class = SpatialitedbsSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
 
-class OtherfilesList(generics.ListCreateAPIView):
+class OtherfilesList(ProfilesConditionalGetMixin, generics.ListCreateAPIView):
     queryset = Otherfiles.objects.all()
     serializer_class = OtherfilesSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
 
-class OtherfilesDetail(generics.RetrieveUpdateDestroyAPIView):
+class OtherfilesDetail(ProfilesConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Otherfiles.objects.all()
     serializer_class = OtherfilesSerializer
     permission_classes = (permissions.IsAuthenticated,)
@@ -129,72 +174,140 @@ class FileUploadView(APIView):
 
 
 class UserProjectsViewSet(ModelViewSet):
-    queryset = UserProject.objects.all()
+    queryset = UserProject.objects.select_related('owner')
     serializer_class = UserProjectSerializer
     parser_classes = (MultiPartParser, FormParser,)
     permission_classes = (permissions.IsAuthenticated,)
 
-    def perform_create(self, serializer):
-        serializer.save(owner=self.request.user, document=self.request.data.get('document'))
+    def create(self, request, *args, **kwargs):
+        """
+        store the uploaded project, unless the owner has already uploaded an identical file -
+        then the existing record is returned and the project is not loaded again
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        document = request.data.get('document')
+        sha256 = file_sha256(document)
+        duplicate = UserProject.find_duplicate(request.user, sha256)
+        if duplicate is not None:
+            return Response(self.get_serializer(duplicate).data, status=status.HTTP_200_OK)
+        serializer.save(owner=request.user, document=document, sha256=sha256)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+
+# resumable, chunked uploads of userprojects, loosely following the tus protocol (https://tus.io):
+#   POST   uploads/        declare the filename, total length and optionally the sha256 of the file
+#   HEAD   uploads/<id>/   the Upload-Offset header says how many bytes have been received
+#   PATCH  uploads/<id>/   send the next chunk as the raw request body, starting at Upload-Offset,
+#                          with an optional "Upload-Checksum: <md5|sha1|sha256> <base64 digest>" header
+#   GET    uploads/<id>/   poll the status: once the last chunk arrives the upload is assembling, then it is done
+#                          (the userproject is set and loaded as usual) or failed (the file did not match the sha256)
+HTTP_460_CHECKSUM_MISMATCH = 460
+
+
+def upload_headers(upload):
+    return {'Upload-Offset': str(upload.offset), 'Upload-Length': str(upload.length)}
+
+
+class UserProjectUploadList(generics.CreateAPIView):
+    """ start a resumable userproject upload """
+    serializer_class = UserProjectUploadSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.save(owner=request.user)
+        headers = upload_headers(upload)
+        headers['Location'] = reverse('userprojectupload-detail', kwargs={'pk': upload.pk}, request=request)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+
+class UserProjectUploadDetail(APIView):
+    """ query the offset of, or send the next chunk to, a resumable userproject upload """
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_object(self, pk, lock=False):
+        queryset = UserProjectUpload.objects.filter(owner=self.request.user)
+        if lock:  # serialize concurrent chunks for the same upload
+            queryset = queryset.select_for_update()
+        return get_object_or_404(queryset, pk=pk)
+
+    def get(self, request, pk, format=None):
+        upload = self.get_object(pk)
+        return Response(UserProjectUploadSerializer(upload).data, headers=upload_headers(upload))
+
+    def patch(self, request, pk, format=None):
+        upload = self.get_object(pk, lock=True)
+        if upload.complete():
+            return Response({'detail': 'upload is already complete'}, status=status.HTTP_409_CONFLICT,
+                            headers=upload_headers(upload))
+        try:
+            offset = int(request.META.get('HTTP_UPLOAD_OFFSET', ''))
+        except ValueError:
+            return Response({'detail': 'Upload-Offset header is required'}, status=status.HTTP_400_BAD_REQUEST,
+                            headers=upload_headers(upload))
+        if offset != upload.offset:
+            return Response({'detail': 'chunk must start at the current offset'}, status=status.HTTP_409_CONFLICT,
+                            headers=upload_headers(upload))
+
+        checksum = request.META.get('HTTP_UPLOAD_CHECKSUM')
+        digest = None
+        if checksum:
+            try:
+                algorithm, expected = checksum.split()
+                digest = hashlib.new(algorithm.lower())
+                expected = base64.b64decode(expected)
+            except ValueError:
+                return Response({'detail': 'unsupported Upload-Checksum'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # read the chunk from the request body a block at a time, never more than the upload still needs
+        limit = min(upload.length - upload.offset, settings.USERPROJECT_UPLOAD_MAX_CHUNK_SIZE)
+        with tempfile.SpooledTemporaryFile(max_size=settings.USERPROJECT_COPY_CHUNK_SIZE) as chunk:
+            size = 0
+            while True:
+                block = request.stream.read(settings.USERPROJECT_COPY_CHUNK_SIZE) if request.stream else b''
+                if not block:
+                    break
+                size += len(block)
+                if size > limit:
+                    return Response({'detail': 'chunk is larger than {0} bytes'.format(limit)},
+                                    status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, headers=upload_headers(upload))
+                if digest:
+                    digest.update(block)
+                chunk.write(block)
+            if size == 0:
+                return Response({'detail': 'empty chunk'}, status=status.HTTP_400_BAD_REQUEST,
+                                headers=upload_headers(upload))
+            if digest and digest.digest() != expected:
+                return Response({'detail': 'chunk checksum mismatch'}, status=HTTP_460_CHECKSUM_MISMATCH,
+                                headers=upload_headers(upload))
+            chunk.seek(0)
+            upload.save_chunk(File(chunk, name=upload.filename))
+
+        if not upload.complete():
+            return Response(status=status.HTTP_204_NO_CONTENT, headers=upload_headers(upload))
+        # the chunks are assembled by a worker once the last one is committed, the client polls the upload
+        # until its status is done (or failed, when the client has to start over)
+        upload_id = str(upload.pk)
+        transaction.on_commit(lambda: AssembleUserProjectUpload.delay(upload_id))
+        return Response(UserProjectUploadSerializer(upload).data, status=status.HTTP_202_ACCEPTED,
+                        headers=upload_headers(upload))
 
 
 def Catalog(request):
     """ View function for home page
     showing summary info about the profile data
     """
-    # counts of database records
-    num_projects = Project.objects.count()
-    num_otherfiles = Otherfiles.objects.count()
-    num_tags = Tag.objects.count()
-    num_spatialitedbs = Spatialitedbs.objects.count()
-    num_basemaps = Basemap.objects.count()
-    num_profiles = Profile.objects.count()
-    num_userprojects = UserProject.objects.count()
-    # user stats
-    user = get_user_model()
-    num_users = user.objects.count()
-    num_superusers = user.objects.filter(is_superuser=True).count()
-    num_profilesets = ProfileSet.objects.count()
-    # get the latest dates
-    rcd_dates = []
-    try:
-        rcd_dates.append(Project.objects.latest('modifieddate').modifieddate)
-    except ObjectDoesNotExist:
-        pass
-    try:
-        rcd_dates.append(Otherfiles.objects.latest('modifieddate').modifieddate)
-    except ObjectDoesNotExist:
-        pass
-    try:
-        rcd_dates.append(Tag.objects.latest('modifieddate').modifieddate)
-    except ObjectDoesNotExist:
-        pass
-    try:
-        rcd_dates.append(Spatialitedbs.objects.latest('modifieddate').modifieddate)
-    except ObjectDoesNotExist:
-        pass
-    try:
-        rcd_dates.append(Basemap.objects.latest('modifieddate').modifieddate)
-    except ObjectDoesNotExist:
-        pass
-    last_rcd = max(rcd_dates).strftime("%Y-%m-%d %H:%M:%S")
-    usr_dates = []
-    try:
-        usr_dates.append(Profile.objects.latest('modifieddate').modifieddate)
-    except ObjectDoesNotExist:
-        pass
-    try:
-        usr_dates.append(UserProject.objects.latest('modifieddate').modifieddate)
-    except ObjectDoesNotExist:
-        pass
-    last_usr = max(usr_dates).strftime("%Y-%m-%d %H:%M:%S")
+    context = catalog_stats().copy()
+    # the latest dates, blank when there are no records yet
+    for name in ('last_rcd', 'last_usr'):
+        context[name] = context[name].strftime("%Y-%m-%d %H:%M:%S") if context[name] else ''
 
     # Render the HTML template index.html with the data in the context variable
     return render(
         request,
         'index.html',
-        context=dict(num_projects=num_projects, num_otherfiles=num_otherfiles, num_tags=num_tags,
-                     num_spatialitedbs=num_spatialitedbs, num_basemaps=num_basemaps, num_profiles=num_profiles,
-                     num_userprojects=num_userprojects, num_users=num_users, num_superusers=num_superusers,
-                     num_profilesets=num_profilesets, last_rcd=last_rcd, last_usr=last_usr),
+        context=context,
     )